@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Seeded generators of synthetic ballots. The ballots are JSON objects as
+posted to `/vote/<electionID>`, so they can be fed to the models, the
+service and the web interface alike.
+
+The correlation structures are
+
+- uniform: every voter picks candidates independently and uniformly,
+- popular: candidates are picked with Zipf-like popularity, so a few candidates are on most ballots,
+- clustered: the candidates form CLUSTERS blocks, and each voter mostly picks from one block.
+"""
+import random
+
+STRUCTURES = ["uniform", "popular", "clustered"]
+
+CLUSTERS = 4
+# The probability that a voter in the clustered structure picks a candidate from their own block.
+CLUSTER_LOYALTY = 0.8
+
+
+def generate_ballots(seed, ballot_type, candidate_ids, num_ballots, structure="uniform"):
+    """
+    Generates ballots for an election.
+
+    :param seed: the same seed always gives the same ballots
+    :param ballot_type: "approvalBallot" or "boundedApprovalBallot"
+    :param candidate_ids: the ids of the candidates of the election
+    :param num_ballots:
+    :param structure: one of STRUCTURES
+    :return: a list of ballots as JSON objects
+    """
+    if structure not in STRUCTURES:
+        raise Exception("This correlation structure is unknown.")
+    generators = {
+        "approvalBallot": approval_ballot,
+        "boundedApprovalBallot": bounded_ballot,
+    }
+    if ballot_type not in generators:
+        raise Exception("This ballot type is unknown.")
+    rng = random.Random(seed)
+    candidate_ids = [str(c) for c in candidate_ids]
+    return [generators[ballot_type](rng, candidate_ids, structure) for _ in range(num_ballots)]
+
+
+def approval_ballot(rng, candidate_ids, structure, max_size=5):
+    """
+    :return: an approval ballot approving 1 to max_size candidates
+    """
+    size = rng.randint(1, min(max_size, len(candidate_ids)))
+    return {"type": "approvalBallot", "app_candidates": pick(rng, candidate_ids, size, structure)}
+
+
+def bounded_ballot(rng, candidate_ids, structure, max_sets=3, max_size=4):
+    """
+    :return: a bounded approval ballot with 1 to max_sets disjoint sets of 1 to max_size candidates each
+    """
+    sizes = [rng.randint(1, max_size) for _ in range(rng.randint(1, max_sets))]
+    picked = pick(rng, candidate_ids, min(sum(sizes), len(candidate_ids)), structure)
+    sets, bounds = dict(), dict()
+    for i, size in enumerate(sizes):
+        items, picked = picked[:size], picked[size:]
+        if not items:
+            break
+        lower = rng.randint(0, len(items))
+        upper = rng.randint(max(lower, 1), len(items))
+        sets[str(i)] = items
+        bounds[str(i)] = [lower, rng.randint(max(lower, 1), upper), upper]
+    return {"type": "boundedApprovalBallot", "sets": sets, "bounds": bounds}
+
+
+def pick(rng, candidate_ids, size, structure):
+    """
+    Picks `size` distinct candidates following the correlation structure.
+
+    :return: a list of candidate ids
+    """
+    if structure == "uniform":
+        return rng.sample(candidate_ids, size)
+    if structure == "popular":
+        # Weighted sampling without replacement: the candidates with the
+        # largest keys u^(1/w) win, for u uniform in (0, 1).
+        keys = [(rng.random() ** (rank + 1), c) for rank, c in enumerate(candidate_ids)]
+        return [c for key, c in sorted(keys, reverse=True)[:size]]
+    block = rng.randrange(CLUSTERS)
+    own = [c for i, c in enumerate(candidate_ids) if i % CLUSTERS == block]
+    picked = list()
+    while len(picked) < size:
+        pool = own if own and rng.random() < CLUSTER_LOYALTY else candidate_ids
+        c = rng.choice(pool)
+        if c not in picked:
+            picked.append(c)
+        own = [c for c in own if c not in picked]
+    return picked
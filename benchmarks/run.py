@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the voting hot paths on synthetic elections (see
+`generators`): ingesting votes through the web interface,
+`Election.add_ballot`, `Election._compute_winner` and `service.search`.
+Every exact engine is checked against the exhaustive reference on the
+scenarios small enough for it.
+
+Run from the root of the repository, e.g.
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --output after.json --compare before.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from goodvotex.voting import engines, service
+from goodvotex.voting.models import Election, Candidate, ApprovalBallot, BoundedApprovalBallot
+from goodvotex.voting.profile import Profile, CompiledApprovalBallot
+from goodvotex.voting.stats import EvaluationStats
+from goodvotex.auth.models import User
+
+from .generators import STRUCTURES, generate_ballots
+
+# Exhaustive search is the reference for scenarios with at most this many committees.
+REFERENCE_LIMIT = 200000
+# _compute_winner is timed up to this many times, unless a run takes more
+# than REPEAT_SECONDS; the fastest run counts.
+REPEATS = 3
+REPEAT_SECONDS = 5
+
+SCENARIOS = [
+    {"ballot_type": "approvalBallot", "candidates": 20, "committeesize": 5, "ballots": 1000},
+    {"ballot_type": "approvalBallot", "candidates": 60, "committeesize": 10, "ballots": 1000},
+    {"ballot_type": "boundedApprovalBallot", "candidates": 12, "committeesize": 4, "ballots": 300},
+    {"ballot_type": "boundedApprovalBallot", "candidates": 18, "committeesize": 6, "ballots": 1000},
+    {"ballot_type": "boundedApprovalBallot", "candidates": 25, "committeesize": 8, "ballots": 1000},
+]
+QUICK_SCENARIOS = [
+    {"ballot_type": "approvalBallot", "candidates": 8, "committeesize": 3, "ballots": 30},
+    {"ballot_type": "boundedApprovalBallot", "candidates": 8, "committeesize": 3, "ballots": 30},
+]
+SEARCH_ELECTIONS = 200
+QUICK_SEARCH_ELECTIONS = 20
+
+CONSTRUCTORS = {
+    "approvalBallot": ApprovalBallot,
+    "boundedApprovalBallot": BoundedApprovalBallot,
+}
+
+
+def run(app, scenarios, structures=STRUCTURES, seed=0, search_elections=SEARCH_ELECTIONS, log=None):
+    """
+    Runs the benchmarks. The app's database should be empty.
+
+    :param app: a GoodVoteX application
+    :param scenarios: dicts with the keys ballot_type, candidates, committeesize and ballots
+    :param structures: the correlation structures each scenario is run with (see `generators`)
+    :param seed: seeds the generated ballots
+    :param search_elections: the number of elections `service.search` looks through
+    :param log: called with a summary of each scenario when it is done (optional)
+    :return: the results as a JSON object
+    """
+    results = list()
+    with app.app_context():
+        owner = User(username="benchmark", name="Benchmark", email="benchmark@example.com", password_hash="x")
+        for scenario in scenarios:
+            for structure in structures:
+                results.append(run_scenario(app, owner, dict(scenario, structure=structure), seed))
+                if log is not None:
+                    log(report_scenario(results[-1]))
+        search = run_search(owner, search_elections)
+    return {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed": seed,
+        "scenarios": results,
+        "search": search,
+    }
+
+
+def run_scenario(app, owner, scenario, seed):
+    """
+    Benchmarks one election.
+
+    :return: the scenario with timings, the counters of the evaluation, and the engine checks
+    """
+    candidates = ["c%d" % i for i in range(scenario["candidates"])]
+    e = service.register_election(scenario["ballot_type"], "Benchmark", "", candidates,
+                                  scenario["committeesize"], owner, tiebreak_seed=seed)
+    ballots = generate_ballots(seed, scenario["ballot_type"], [c.id for c in e.candidates],
+                               scenario["ballots"], scenario["structure"])
+    result = dict(scenario)
+
+    client = app.test_client()
+    started = time.perf_counter()
+    for ballot in ballots:
+        response = client.post("/vote/%d" % e.id, json=ballot)
+        if response.status_code != 200:
+            raise Exception("Vote was rejected: " + response.get_data(as_text=True))
+    result["ingest"] = _rate(time.perf_counter() - started, len(ballots))
+
+    dummy = Election(title="Benchmark", description="", committeesize=e.committeesize, is_stopped=False,
+                     ballot_type=e.ballot_type, votecount=0, ballots=list())
+    dummy.candidates = [Candidate(name=c.name, id=c.id) for c in e.candidates]
+    constructor = CONSTRUCTORS[scenario["ballot_type"]]
+    started = time.perf_counter()
+    for ballot in ballots:
+        dummy.add_ballot(constructor(ballot))
+    result["add_ballot"] = _rate(time.perf_counter() - started, len(ballots))
+
+    e = service.get_election(e.id)
+    timings = list()
+    for _ in range(REPEATS):
+        stats = EvaluationStats()
+        started = time.perf_counter()
+        e._compute_winner(e.evaluation_mode or "exact", stats, e.tiebreak_rng())
+        timings.append(time.perf_counter() - started)
+        if timings[-1] > REPEAT_SECONDS:
+            break
+    result["compute_winner"] = {"seconds": min(timings), "stats": stats.to_dict()}
+
+    profile = Profile(list(e.candidates), patterns=list(e.patterns))
+    result["engines"] = check_engines(profile, e.committeesize, seed)
+    return result
+
+
+def check_engines(profile, committeesize, seed):
+    """
+    Runs every exact engine applicable to the profile and compares it with
+    the exhaustive reference: the best score, the number of tied committees,
+    and the score of the committee chosen must agree.
+
+    Larger profiles are skipped, as engines without pruning would take ages.
+
+    :return: a dict from engine names to {"seconds", "agrees"}
+    """
+    if math.comb(len(profile.candidates), committeesize) > REFERENCE_LIMIT:
+        return dict()
+    reference = engines.exhaustive(profile, committeesize)
+    checks = dict()
+    for name in exact_engines(profile):
+        engine = engines.choose_engine(profile, "exact", committeesize, workers=2, engine=name)
+        started = time.perf_counter()
+        result = engine(profile, committeesize, rng=random.Random(seed))
+        seconds = time.perf_counter() - started
+        agrees = result.score == reference.score and result.ties == reference.ties and \
+            len(result.committees) == 1 and profile.score(result.committees[0]) == reference.score
+        checks[name] = {"seconds": seconds, "agrees": agrees}
+    return checks
+
+
+def exact_engines(profile):
+    """
+    :return: the names of the exact engines which can evaluate the profile
+    """
+    names = ["exhaustive"]
+    if all(isinstance(entry, CompiledApprovalBallot) for entry, count in profile.entries):
+        names.append("approval")
+    if profile.rows() is not None:
+        names += ["branch-and-bound", "revolving-door", "symmetric", "parallel"]
+        try:
+            import numpy
+            names.append("vectorized")
+        except ImportError:
+            pass
+    return names
+
+
+def run_search(owner, num_elections):
+    """
+    Times `service.search` over `num_elections` elections.
+
+    :return: {"elections", "seconds"}, the seconds being per search
+    """
+    rng = random.Random(0)
+    words = ["board", "council", "student", "committee", "jury", "club", "team", "annual", "spring", "award"]
+    for i in range(num_elections):
+        title = " ".join(rng.sample(words, 3))
+        service.register_election("approvalBallot", "%s %d" % (title, i), " ".join(rng.sample(words, 5)),
+                                  ["a", "b", "c"], 2, owner)
+    started = time.perf_counter()
+    for keyword in words:
+        service.search(keyword)
+    return {"elections": num_elections, "seconds": (time.perf_counter() - started) / len(words)}
+
+
+def compare(results, baseline):
+    """
+    :return: lines comparing the timings of two runs, as ratio new / baseline
+    """
+    def key(scenario):
+        return (scenario["ballot_type"], scenario["candidates"], scenario["committeesize"],
+                scenario["ballots"], scenario["structure"])
+    before = {key(s): s for s in baseline["scenarios"]}
+    lines = ["Compared with %s (ratio new / baseline, lower is faster):" % baseline.get("commit")]
+    for scenario in results["scenarios"]:
+        old = before.get(key(scenario))
+        if old is None:
+            continue
+        ratios = ["%s=%.2f" % (name, scenario[name]["seconds"] / old[name]["seconds"])
+                  for name in ["ingest", "add_ballot", "compute_winner"] if old[name]["seconds"] > 0]
+        lines.append("  %s: %s" % (_label(scenario), " ".join(ratios)))
+    if baseline["search"]["seconds"] > 0:
+        lines.append("  search: %.2f" % (results["search"]["seconds"] / baseline["search"]["seconds"]))
+    return lines
+
+
+def report(results):
+    """
+    :return: lines summarizing the results
+    """
+    lines = [line for scenario in results["scenarios"] for line in report_scenario(scenario)]
+    lines.append("search over %d elections: %.4fs" % (results["search"]["elections"], results["search"]["seconds"]))
+    return lines
+
+
+def report_scenario(scenario):
+    """
+    :return: lines summarizing the results of one scenario
+    """
+    lines = ["%s: ingest %.0f votes/s, add_ballot %.0f ballots/s, compute_winner %.4fs" % (
+        _label(scenario), scenario["ingest"]["per_second"], scenario["add_ballot"]["per_second"],
+        scenario["compute_winner"]["seconds"])]
+    for name, check in scenario["engines"].items():
+        lines.append("    %-16s %.4fs %s" % (name, check["seconds"], "agrees" if check["agrees"] else "DISAGREES"))
+    return lines
+
+
+def _label(scenario):
+    return "%s n=%d k=%d votes=%d %s" % (scenario["ballot_type"], scenario["candidates"],
+                                         scenario["committeesize"], scenario["ballots"], scenario["structure"])
+
+
+def _rate(seconds, count):
+    return {"seconds": seconds, "per_second": count / seconds if seconds > 0 else 0}
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the voting hot paths of GoodVoteX.")
+    parser.add_argument("--quick", action="store_true", help="run small scenarios only")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the results as JSON to this file")
+    parser.add_argument("--compare", help="compare with the results saved in this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["FLASK_DB_RELATIVE_PATH"] = os.path.join(directory, "benchmark.db")
+        os.environ.setdefault("FLASK_SECRET_KEY", "benchmark")
+        import goodvotex
+        app = goodvotex.create_app()
+        with app.app_context():
+            goodvotex.db.create_all()
+        results = run(app, QUICK_SCENARIOS if args.quick else SCENARIOS, seed=args.seed,
+                      search_elections=QUICK_SEARCH_ELECTIONS if args.quick else SEARCH_ELECTIONS,
+                      log=lambda lines: print("\n".join(lines), flush=True))
+
+    print("search over %d elections: %.4fs" % (results["search"]["elections"], results["search"]["seconds"]))
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare(results, json.load(f)):
+                print(line)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    disagreeing = [(s, name) for s in results["scenarios"] for name, check in s["engines"].items()
+                   if not check["agrees"]]
+    return 1 if disagreeing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
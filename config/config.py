@@ -8,4 +8,21 @@ class AuthConfig(object):
 class GoodVoteXConfig(object):
     GOODVOTEX_IMPRINT_URL = ""
     GOODVOTEX_PRIVACY_URL = ""
-    GOODVOTEX_TERMS_CONDITIONS_URL = ""
\ No newline at end of file
+    GOODVOTEX_TERMS_CONDITIONS_URL = ""
+    GOODVOTEX_EVALUATION_WORKERS = 0
+    GOODVOTEX_EVALUATION_ENGINE = "auto"
+    GOODVOTEX_BACKGROUND_EVALUATION = False
+    GOODVOTEX_JOB_TIMEOUT = 3600
+    GOODVOTEX_RESULT_CACHE_SIZE = 256
+    GOODVOTEX_EVALUATION_TIME_BUDGET = 0
+    GOODVOTEX_EVALUATION_COMMITTEE_BUDGET = 0
+    GOODVOTEX_EXPECTED_VOTES = 100
+    GOODVOTEX_EXACT_EVALUATION_LIMIT = 0
+    GOODVOTEX_EVALUATION_LIMIT = 0
+    GOODVOTEX_PROFILE_DIR = ""
+    GOODVOTEX_ENABLE_METRICS = True
+    GOODVOTEX_WRITE_BEHIND = False
+    GOODVOTEX_WRITE_BEHIND_QUEUE = 10000
+    GOODVOTEX_WRITE_BEHIND_BATCH = 500
+    GOODVOTEX_WRITE_BEHIND_INTERVAL = 0.5
+    GOODVOTEX_MAX_BATCH_VOTES = 1000
\ No newline at end of file
@@ -9,4 +9,8 @@ HOST=0.0.0.0
 flask goodvotex create-db
 flask auth add-user admin "Armin Admin" "${GOODVOTX_ADMIN_EMAIL}" "${GOODVOTEX_ADMIN_PASSWORD}"
 
+if [[ "${FLASK_GOODVOTEX_BACKGROUND_EVALUATION,,}" =~ ^(true|yes|1)$ ]]; then
+    flask goodvotex worker &
+fi
+
 waitress-serve --host "${HOST}" --port "${HOST_PORT}" --call goodvotex:create_app
\ No newline at end of file
@@ -26,7 +26,8 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(ROOT_DIR / app.config['DB_RELATIVE_PATH'])
 
     # Since Env vars are always loaded as string, we may need to cast them.
-    BOOLEAN_CONFIG_KEYS = ["AUTH_ENABLE_REGISTRATION"]
+    BOOLEAN_CONFIG_KEYS = ["AUTH_ENABLE_REGISTRATION", "GOODVOTEX_BACKGROUND_EVALUATION", "GOODVOTEX_ENABLE_METRICS",
+                           "GOODVOTEX_WRITE_BEHIND"]
     for key in BOOLEAN_CONFIG_KEYS:
         if not isinstance(app.config[key], bool):
             app.config[key] = True if app.config[key].lower() in ['true', 'yes', '1'] else False
@@ -49,8 +50,15 @@ def create_app():
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(auth_cli_blueprint)
 
-    from .voting import voting as voting_blueprint
+    from .voting import voting as voting_blueprint, cost
     app.register_blueprint(voting_blueprint)
+    cost.get_model()  # calibrate now rather than in the first request
+    if app.config["GOODVOTEX_WRITE_BEHIND"]:
+        from .voting import buffer
+        buffer.exit_on_sigterm()  # to write the buffered votes before exiting
+
+    from .metrics import metrics as metrics_blueprint
+    app.register_blueprint(metrics_blueprint)
 
     from .cli import goodvotex_cli as goodvotex_cli_blueprint
     app.register_blueprint(goodvotex_cli_blueprint)
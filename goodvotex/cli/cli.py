@@ -1,6 +1,10 @@
+import time
+
 import click
+import sqlalchemy
 from . import goodvotex_cli
 from .. import db
+from ..voting import service, importers
 
 
 @goodvotex_cli.cli.command("create-db")
@@ -11,4 +15,125 @@ def create_db(overwrite):
         db.drop_all()
 
     db.create_all()
+    upgrade_db()
     print("Database ready.")
+
+
+def upgrade_db():
+    """
+    Adds the columns which are missing in existing tables, e.g. in a database
+    created by an older version. `db.create_all` only creates missing tables.
+    Existing rows get the column's default value.
+
+    :return: a list of the added columns as "table.column"
+    """
+    added = list()
+    inspector = sqlalchemy.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = "ALTER TABLE %s ADD COLUMN %s %s" % (
+                table.name, column.name, column.type.compile(dialect=db.engine.dialect))
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if default is not None:
+                ddl += " DEFAULT %s" % repr(int(default) if isinstance(default, bool) else default)
+            with db.engine.begin() as connection:
+                connection.execute(sqlalchemy.text(ddl))
+            added.append("%s.%s" % (table.name, column.name))
+    for column in added:
+        print("Added column {}.".format(column))
+    return added
+
+
+
+@goodvotex_cli.cli.command("recount")
+@click.argument("election_id")
+def recount(election_id):
+    if service.get_election(election_id) is None:
+        print("An election with id '{}' doesn't exist.".format(election_id))
+    elif service.recount(election_id):
+        print("Tallies of election '{}' are correct.".format(election_id))
+    else:
+        print("Tallies of election '{}' were wrong and have been recounted.".format(election_id))
+
+
+
+@goodvotex_cli.cli.command("import-ballots")
+@click.argument("election_id")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "file_format", type=click.Choice(["auto", "csv", "jsonl", "preflib"]), default="auto",
+              show_default=True, help="The file format; auto guesses it from the file extension.")
+@click.option("--chunk-size", default=5000, show_default=True, help="Ballots checked and inserted at once.")
+def import_ballots(election_id, file, file_format, chunk_size):
+    e = service.get_election(election_id)
+    if e is None:
+        print("An election with id '{}' doesn't exist.".format(election_id))
+        return
+    try:
+        if file_format == "auto":
+            file_format = importers.guess_format(file.name)
+        lines = importers.parse(file, file_format, e.ballot_type, {c.name: str(c.id) for c in e.candidates})
+        started = time.perf_counter()
+        imported, rejected = 0, 0
+        for chunk in _chunks(lines, chunk_size):
+            for line in [line for line in chunk if line.error is not None]:
+                rejected += 1
+                _report_rejected(rejected, line.line, line.error)
+            chunk = [line for line in chunk if line.error is None]
+            errors = service.add_votes_from_json(e.id, [line.ballot for line in chunk], [line.count for line in chunk])
+            for line, error in zip(chunk, errors):
+                if error is None:
+                    imported += line.count
+                else:
+                    rejected += 1
+                    _report_rejected(rejected, line.line, error)
+            print("Imported {} ballots ({:.0f} ballots/s).".format(imported, imported / (time.perf_counter() - started)))
+    except Exception as ex:
+        print("Import failed: {}".format(ex))
+        return
+    seconds = time.perf_counter() - started
+    print("Imported {} ballots in {:.1f}s ({:.0f} ballots/s), rejected {} lines.".format(
+        imported, seconds, imported / seconds if seconds > 0 else 0, rejected))
+
+
+# Rejected lines beyond this many are only counted.
+REPORTED_REJECTIONS = 20
+
+
+def _report_rejected(rejected, line, error):
+    if rejected <= REPORTED_REJECTIONS:
+        print("Rejected line {}: {}".format(line, error))
+    elif rejected == REPORTED_REJECTIONS + 1:
+        print("Not showing further rejected lines.")
+
+
+def _chunks(iterable, size):
+    chunk = list()
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+
+@goodvotex_cli.cli.command("worker")
+@click.option("--interval", default=1.0, show_default=True, help="Seconds to wait when there is no job.")
+@click.option("--once", is_flag=True, default=False, help="Exit when there is no job.")
+def worker(interval, once):
+    print("Waiting for evaluation jobs.")
+    while True:
+        job = service.claim_evaluation_job()
+        if job is None:
+            if once:
+                break
+            time.sleep(interval)
+            continue
+        service.run_evaluation_job(job)
+        print("Evaluated election '{}' with {} votes: {}.".format(job.election_id, job.votecount, job.status))
@@ -0,0 +1,15 @@
+from flask import Blueprint
+
+from .registry import Registry
+
+metrics = Blueprint('metrics', __name__)
+metrics.config = dict()
+registry = Registry()
+
+
+@metrics.record
+def record_params(setup_state):
+    app = setup_state.app
+    metrics.config = dict([(key, value) for (key, value) in app.config.items()])
+
+from . import views
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import bisect
+import threading
+from collections import OrderedDict
+
+# Upper bounds (in seconds) of the buckets of latency histograms.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry(object):
+    """
+    In-process metrics, exported in the Prometheus text format (see
+    `render`). Recording must be cheap, as it happens on every request: each
+    thread records into its own shard without locking, and the shards are
+    only summed up when the metrics are scraped. Shards of finished threads
+    are folded into a running total, so counts are never lost.
+    """
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._collectors = list()
+        self._shards = list()  # (thread, shard); a shard maps (name, labels) to a value
+        self._retired = dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation):
+        """
+        :return: the Counter with this name, registered if new
+        """
+        return self._register(Counter(self, name, documentation))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: the upper bounds of the buckets, ascending
+        :return: the Histogram with this name, registered if new
+        """
+        return self._register(Histogram(self, name, documentation, buckets))
+
+    def collector(self, function):
+        """
+        Registers a function called on every scrape, for values kept
+        elsewhere (e.g. cache statistics).
+
+        :param function: returns a list of (name, type, documentation, value)
+        :return: function, so this can be used as decorator
+        """
+        with self._lock:
+            self._collectors.append(function)
+        return function
+
+    def shard(self):
+        """
+        :return: the shard of the current thread
+        """
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = dict()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def collect(self):
+        """
+        :return: a dict from (name, labels) to the value summed over all threads
+        """
+        totals = dict()
+        with self._lock:
+            alive = list()
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                    _merge(totals, shard)
+                else:
+                    _merge(self._retired, shard)
+            self._shards = alive
+            _merge(totals, self._retired)
+        return totals
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        samples = dict()
+        for (name, labels), value in sorted(self.collect().items()):
+            samples.setdefault(name, list()).append((labels, value))
+        lines = list()
+        for metric in list(self._metrics.values()):
+            lines += metric.render(samples.get(metric.name, list()))
+        for function in list(self._collectors):
+            for name, kind, documentation, value in function():
+                lines += ["# HELP %s %s" % (name, documentation), "# TYPE %s %s" % (name, kind),
+                          "%s %s" % (name, _format(value))]
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """
+        Resets all values to zero, e.g. between tests.
+        """
+        with self._lock:
+            for thread, shard in self._shards:
+                shard.clear()
+            self._retired.clear()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+
+class Counter(object):
+    """
+    A value that only goes up, e.g. the number of requests.
+    """
+
+    def __init__(self, registry, name, documentation):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+
+    def inc(self, amount=1, **labels):
+        shard = self.registry.shard()
+        key = (self.name, tuple(sorted(labels.items())))
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self, samples):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s counter" % self.name]
+        for labels, value in samples:
+            lines.append("%s%s %s" % (self.name, _labels(labels), _format(value)))
+        return lines
+
+
+class Histogram(object):
+    """
+    Counts observations, e.g. latencies, in buckets by their size.
+    """
+
+    def __init__(self, registry, name, documentation, buckets):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self.registry.shard()
+        key = (self.name, tuple(sorted(labels.items())))
+        counts = shard.get(key)
+        if counts is None:
+            # One count per bucket, one for +Inf, and the sum of all values.
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, samples):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s histogram" % self.name]
+        for labels, counts in samples:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (self.name, _labels(labels + (("le", _format(bound)),)), cumulative))
+            lines.append("%s_sum%s %s" % (self.name, _labels(labels), _format(counts[-1])))
+            lines.append("%s_count%s %d" % (self.name, _labels(labels), cumulative))
+        return lines
+
+
+def _merge(totals, shard):
+    # Copies first, as the owning thread may record meanwhile.
+    for key, value in list(shard.items()):
+        if isinstance(value, list):
+            value = list(value)
+            previous = totals.get(key)
+            totals[key] = value if previous is None else [a + b for a, b in zip(previous, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, _escape(value)) for key, value in labels)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,46 @@
+import time
+
+from flask import request, g, has_request_context, abort, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics, registry
+
+REQUESTS = registry.counter("goodvotex_http_requests_total", "HTTP requests, by method, route and status.")
+LATENCY = registry.histogram("goodvotex_http_request_duration_seconds", "Time to answer HTTP requests, by route.")
+QUERIES = registry.histogram("goodvotex_http_request_db_queries", "Database queries per HTTP request, by route.",
+                             buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+DB_QUERIES = registry.counter("goodvotex_db_queries_total", "Database queries, in and outside of requests.")
+
+
+@metrics.before_app_request
+def start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = 0
+
+
+@metrics.after_app_request
+def record_request(response):
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return response
+    # The rule rather than the path, e.g. /details/<electionID>, to keep the number of labels small.
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    REQUESTS.inc(method=request.method, route=route, status=str(response.status_code))
+    LATENCY.observe(time.perf_counter() - started, route=route)
+    QUERIES.observe(g.pop("metrics_queries", 0), route=route)
+    return response
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    DB_QUERIES.inc()
+    if has_request_context() and "metrics_queries" in g:
+        g.metrics_queries += 1
+
+
+@metrics.route('/metrics')
+def export():
+    if not metrics.config.get("GOODVOTEX_ENABLE_METRICS", True):
+        abort(404)
+    return Response(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -5,3 +5,10 @@ from flask import Blueprint
 logger = logging.getLogger(__name__)
 
 voting = Blueprint('voting', __name__, template_folder='templates')
+voting.config = dict()
+
+
+@voting.record
+def record_params(setup_state):
+    app = setup_state.app
+    voting.config = dict([(key, value) for (key, value) in app.config.items()])
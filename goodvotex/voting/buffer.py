@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import atexit
+import queue
+import signal
+import sys
+import threading
+import time
+
+from . import logger
+
+_STOP = object()
+
+
+class BufferFull(Exception):
+    """
+    Raised when votes arrive faster than they can be written.
+    """
+    pass
+
+
+class VoteBuffer(object):
+    """
+    Write-behind buffer for votes (GOODVOTEX_WRITE_BEHIND). Votes are checked
+    before they are put here, and a background thread writes them in batches:
+    a batch is written when it has `batch_size` votes, or `interval` seconds
+    after its first vote, in one transaction, i.e. with one fsync on SQLite.
+
+    Durability: a vote is stored at most `interval` seconds (plus the time to
+    write a batch) after it was accepted. `close` writes all queued votes and
+    is called when the process exits, also on SIGTERM (see `exit_on_sigterm`);
+    only a crash of the process loses the queued votes.
+
+    Backpressure: at most `maxsize` votes are queued. If the queue is full,
+    `put` waits up to `timeout` seconds for space and then raises BufferFull.
+    """
+
+    def __init__(self, app, write, maxsize=10000, batch_size=500, interval=0.5, timeout=1.0):
+        """
+        :param app: the application whose database the votes are written to
+        :param write: called in an app context with a list of votes, writes them in one transaction
+        :param maxsize: the maximum number of queued votes
+        :param batch_size: the maximum number of votes per transaction
+        :param interval: seconds a vote waits at most for further votes of its batch
+        :param timeout: seconds `put` waits at most for space in a full queue
+        """
+        self.app = app
+        self.write = write
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def put(self, vote):
+        """
+        Queues a vote for writing.
+
+        :param vote: passed on to `write`
+        :return:
+        """
+        if self._closed:
+            raise BufferFull("The server is shutting down. Please try again later.")
+        self._start()
+        try:
+            self._queue.put(vote, timeout=self.timeout)
+        except queue.Full:
+            raise BufferFull("There are too many votes at the moment. Please try again in a few seconds.")
+
+    def pending(self):
+        """
+        :return: the number of queued votes (approximately)
+        """
+        return self._queue.qsize()
+
+    def flush(self):
+        """
+        Writes all queued votes now, in the calling thread.
+
+        :return:
+        """
+        batch = list()
+        while True:
+            try:
+                vote = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if vote is not _STOP:
+                batch.append(vote)
+            if len(batch) == self.batch_size:
+                self._write(batch)
+                batch = list()
+        if batch:
+            self._write(batch)
+
+    def close(self):
+        """
+        Stops the background thread and writes all queued votes.
+
+        :return:
+        """
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+        self.flush()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vote-buffer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            vote = self._queue.get()
+            if vote is _STOP:
+                return
+            batch = [vote]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    vote = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if vote is _STOP:
+                    self._write(batch)
+                    return
+                batch.append(vote)
+            self._write(batch)
+
+    def _write(self, batch):
+        with self.app.app_context():
+            try:
+                self.write(batch)
+            except Exception as ex:
+                # `write` handles failing votes itself; this must not stop the thread.
+                logger.error("Writing %d buffered votes failed: %s" % (len(batch), ex))
+
+
+def exit_on_sigterm():
+    """
+    Makes SIGTERM (e.g. from `docker stop`) exit the process like Ctrl-C
+    does, so that the buffered votes are written before. Only possible in
+    the main thread, and only if SIGTERM has no handler yet.
+
+    :return:
+    """
+    if threading.current_thread() is threading.main_thread() and \
+            signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
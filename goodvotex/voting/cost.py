@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+import time
+from types import SimpleNamespace
+
+from . import engines
+from .profile import Profile, contribution
+
+# The number of bounded sets assumed per bounded approval ballot when only the
+# size of the electorate is known.
+SETS_PER_BALLOT = 2
+# Seconds to start a worker process of the parallel engine.
+PROCESS_STARTUP = 0.05
+# Seconds branch-and-bound runs on a random profile to estimate its runtime,
+# and the largest profile (in rows) it is run on.
+PROBE_SECONDS = 0.2
+PROBE_ROWS = 512
+
+
+class CostModel(object):
+    """
+    Estimates how long the engines take to compute a winner. The exact
+    engines score ( |candidates| \\choose committeesize ) committees against
+    every row of the profile (see `Profile.rows`), so their work is counted in
+    committee-row pairs; `unit_costs` holds the seconds per pair of each engine.
+    How much branch-and-bound prunes depends on the size of the election, so
+    its runtime is estimated by running it briefly (see `probe`).
+
+    The unit costs depend on the machine, so `calibrate` measures them with a
+    quick micro-benchmark.
+    """
+
+    # Measured on a laptop, used until the model is calibrated.
+    DEFAULT_UNIT_COSTS = {
+        "exhaustive": 4e-7,
+        "parallel": 2e-7,
+        "vectorized": 2e-8,
+    }
+
+    def __init__(self, unit_costs=None):
+        self.unit_costs = dict(self.DEFAULT_UNIT_COSTS)
+        self.unit_costs.update(unit_costs or dict())
+        self._probes = dict()
+
+    @classmethod
+    def calibrate(cls, num_candidates=12, committeesize=5, num_rows=50, seed=0):
+        """
+        Time the engines on a random profile of bounded sets.
+
+        :return: a CostModel
+        """
+        profile = _synthetic_profile(num_candidates, num_rows, seed)
+        rows = profile.rows()
+        pairs = math.comb(num_candidates, committeesize) * len(rows)
+        benchmarks = {
+            "exhaustive": lambda: engines.exhaustive(profile, committeesize),
+            "parallel": lambda: engines._score_range(rows, num_candidates, committeesize, 0,
+                                                     math.comb(num_candidates, committeesize)),
+        }
+        if engines.numpy is not None:
+            benchmarks["vectorized"] = lambda: engines.vectorized(profile, committeesize)
+        unit_costs = dict()
+        for name, benchmark in benchmarks.items():
+            started = time.perf_counter()
+            benchmark()
+            unit_costs[name] = (time.perf_counter() - started) / pairs
+        return cls(unit_costs)
+
+    def estimate(self, engine, num_candidates, committeesize, num_rows, workers=1):
+        """
+        Estimate the runtime of an engine.
+
+        :param engine: a key of `engines.ENGINES`
+        :param num_candidates:
+        :param committeesize:
+        :param num_rows: the number of rows (bounded sets) of the profile
+        :param workers: number of processes of the parallel engine
+        :return: seconds
+        """
+        num_rows = max(1, num_rows)
+        if engine == "approval":
+            return self.unit_costs["exhaustive"] * num_rows
+        if engine == "approximate":
+            # Greedy adds committeesize members, each local search round tries
+            # every swap; assume committeesize rounds.
+            committees = committeesize * num_candidates * (1 + committeesize * (num_candidates - committeesize))
+            return self.unit_costs["exhaustive"] * committees * num_rows
+        if engine == "branch-and-bound":
+            return self.probe(num_candidates, committeesize, num_rows)
+        pairs = math.comb(num_candidates, committeesize) * num_rows
+        if engine == "parallel":
+            return PROCESS_STARTUP * workers + self.unit_costs["parallel"] * pairs / workers
+        return self.unit_costs.get(engine, self.unit_costs["exhaustive"]) * pairs
+
+    def probe(self, num_candidates, committeesize, num_rows):
+        """
+        Estimate the runtime of branch-and-bound: run it on a random profile
+        for at most PROBE_SECONDS and extrapolate from the fraction of
+        committees it covered (see `Result.coverage`), which includes the
+        pruned ones. The committees covered first are the most promising and
+        the least pruned, so this rather overestimates. Estimates are
+        remembered per size of the election.
+
+        :return: seconds
+        """
+        probe_rows = min(1 << (max(1, num_rows) - 1).bit_length(), PROBE_ROWS)
+        key = (num_candidates, committeesize, probe_rows)
+        if key not in self._probes:
+            if math.comb(num_candidates, committeesize) == 0:
+                return 0
+            profile = _synthetic_profile(num_candidates, probe_rows, 0)
+            incumbent = profile.score(engines._greedy(profile, committeesize))
+            started = time.perf_counter()
+            result = engines.branch_and_bound(profile, committeesize,
+                                              budget=engines.Budget(PROBE_SECONDS, incumbent=incumbent))
+            elapsed = time.perf_counter() - started
+            self._probes[key] = elapsed / result.coverage if result.coverage else math.inf
+        # The work per committee grows linearly with the rows.
+        return self._probes[key] * max(1, num_rows / probe_rows)
+
+    def fastest_exact(self, num_candidates, committeesize, num_rows, workers=1):
+        """
+        The fastest exact engine for profiles of bounded sets. The vectorized
+        engine is not considered, as it is only used if forced. Parallel
+        scoring is weighed against branch-and-bound only with several workers.
+
+        :return: a tuple (key of `engines.ENGINES`, estimated seconds)
+        """
+        names = ["branch-and-bound"]
+        if workers > 1:
+            names.append("parallel")
+        return min(((name, self.estimate(name, num_candidates, committeesize, num_rows, workers)) for name in names),
+                   key=lambda estimate: estimate[1])
+
+    def estimate_election(self, ballot_type, num_candidates, committeesize, num_votes, mode="exact", workers=1):
+        """
+        Estimate the runtime of evaluating an election before its ballots are known.
+
+        :param ballot_type: "approvalBallot" or "boundedApprovalBallot"
+        :param num_candidates:
+        :param committeesize:
+        :param num_votes: the expected number of votes
+        :param mode: one of `engines.MODES`
+        :param workers:
+        :return: seconds
+        """
+        num_rows = num_votes if ballot_type == "approvalBallot" else num_votes * SETS_PER_BALLOT
+        if mode == "approximate":
+            return self.estimate("approximate", num_candidates, committeesize, num_rows)
+        if ballot_type == "approvalBallot":
+            return self.estimate("approval", num_candidates, committeesize, num_rows)
+        return self.fastest_exact(num_candidates, committeesize, num_rows, workers)[1]
+
+
+_model = None
+
+
+def get_model():
+    """
+    The cost model of this process, calibrated the first time it is needed
+    (`create_app` does so at startup).
+
+    :return: a CostModel
+    """
+    global _model
+    if _model is None:
+        _model = CostModel.calibrate()
+    return _model
+
+
+class _SyntheticRow(object):
+    """
+    A compiled ballot consisting of a single bounded set, for benchmarks.
+    """
+    __slots__ = ('mask', 'lower', 'saturation', 'upper')
+
+    def __init__(self, mask, lower, saturation, upper):
+        self.mask = mask
+        self.lower = lower
+        self.saturation = saturation
+        self.upper = upper
+
+    def score(self, committee):
+        return contribution((self.mask & committee).bit_count(), self.lower, self.saturation, self.upper)
+
+    def rows(self):
+        return ((self.mask, self.lower, self.saturation, self.upper),)
+
+
+def _synthetic_profile(num_candidates, num_rows, seed):
+    rng = random.Random(seed)
+    profile = Profile([SimpleNamespace(id=i) for i in range(num_candidates)])
+    for _ in range(num_rows):
+        members = rng.sample(range(num_candidates), rng.randint(1, 3))
+        lower = rng.randint(0, len(members))
+        upper = rng.randint(max(lower, 1), len(members))
+        mask = sum(1 << i for i in members)
+        profile.entries.append((_SyntheticRow(mask, lower, rng.randint(max(lower, 1), upper), upper), 1))
+    profile.ballot_count = num_rows
+    return profile
@@ -0,0 +1,837 @@
+# -*- coding: utf-8 -*-
+import functools
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .profile import CompiledApprovalBallot, contribution, contribution_table
+
+try:
+    import numpy
+except ImportError:  # optional, only needed by the vectorized engine
+    numpy = None
+
+
+class Result(object):
+    """
+    Outcome of a winner computation: the best score, the number `ties` of
+    committees reaching it and one of them (a bitmask, see
+    `Profile.members`) chosen uniformly at random, in `committees`. Engines
+    count the tied committees and keep the chosen one by reservoir sampling,
+    so their memory does not grow with the number of ties (e.g. every
+    committee ties before the first vote). The random numbers are drawn from
+    the engine's `rng`, which makes the tie-break reproducible if it is
+    seeded. Exact engines have `upper_bound == score`; approximate ones
+    report an upper bound on the optimal score (None if unknown).
+
+    An engine stopped by its `Budget` returns the best committees found so
+    far: `position` is the rank (in the engine's combination order) to resume
+    from and `total` the number of committees, so `complete` is False and
+    `coverage` tells which fraction of the committees was covered.
+
+    For profiling, `scored` counts the committees the engine scored.
+    """
+
+    def __init__(self, score, committees, upper_bound=None, exact=True, position=None, total=None, ties=None,
+                 scored=0):
+        self.score = score
+        self.committees = committees
+        self.ties = len(committees) if ties is None else ties
+        self.scored = scored
+        self.exact = exact
+        self.position = position
+        self.total = total
+        self.complete = position is None or position >= total
+        self.upper_bound = score if exact and self.complete else upper_bound
+
+    @property
+    def coverage(self):
+        if self.complete:
+            return 1.0
+        return self.position / self.total
+
+
+class Budget(object):
+    """
+    Limits the work of an anytime evaluation. The engines supporting budgets
+    (`exhaustive` and `branch_and_bound`) enumerate committees in a fixed
+    combination order, start at rank `start` and stop when the budget is used
+    up (see `Result.position`). The committee at `start` is always scored, so
+    every evaluation makes progress.
+
+    :param seconds: wall-clock time limit (None: unlimited)
+    :param committees: maximum number of committees to score (None: unlimited)
+    :param start: the rank to continue from
+    :param incumbent: the best score found before `start`; only committees
+                      reaching at least this score are returned
+    """
+
+    # Reading the clock costs more than scoring a small committee.
+    CLOCK_INTERVAL = 256
+
+    def __init__(self, seconds=None, committees=None, start=0, incumbent=0):
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.remaining = committees or None
+        self.start = start or 0
+        self.incumbent = incumbent or 0
+        self._steps = 0
+        self._expired = False
+
+    def spend(self):
+        """
+        Take one committee from the budget.
+
+        :return: True if the budget is used up, i.e. the committee must not be scored.
+        """
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return True
+            self.remaining -= 1
+        return self.expired()
+
+    def expired(self):
+        """
+        :return: True if the time limit is over.
+        """
+        if self.deadline is None:
+            return False
+        if not self._expired:
+            self._steps += 1
+            self._expired = self._steps % self.CLOCK_INTERVAL == 0 and time.monotonic() > self.deadline
+        return self._expired
+
+
+class _OutOfBudget(Exception):
+
+    def __init__(self, members):
+        self.members = members
+
+
+def _chosen(committee):
+    return list() if committee is None else [committee]
+
+
+MODES = ["exact", "approximate"]
+
+# Below this many committees, starting worker processes costs more than it saves.
+PARALLEL_THRESHOLD = 200000
+# Interchangeable candidates are only merged (see `symmetric`) if this
+# reduces the number of committees to check by at least this factor, as
+# branch-and-bound prunes most committees otherwise.
+SYMMETRY_GAIN = 100
+# Engines reporting progress do so every this many steps.
+PROGRESS_STEPS = 1 << 14
+
+
+def choose_engine(profile, mode="exact", committeesize=None, workers=1, engine="auto", budget=None,
+                  cost_model=None, progress=None):
+    """
+    Pick the evaluation engine for a profile.
+
+    :param profile: a Profile
+    :param mode: one of MODES
+    :param committeesize: needed to decide between the exact engines
+    :param workers: number of processes an engine may use (0: all cores)
+    :param engine: a key of ENGINES to force a specific engine, or "auto"
+    :param budget: a Budget for anytime evaluation (None: run to completion).
+                   Only the closed form for approval ballots and the engines
+                   supporting budgets are chosen then.
+    :param cost_model: a `cost.CostModel` to pick the fastest exact engine
+                       (None: fixed thresholds)
+    :param progress: called now and then with the fraction of committees
+                     covered, by the engines in PROGRESS_ENGINES
+    :return: an engine, i.e. a function (profile, committeesize) -> Result
+    """
+    chosen = _choose_engine(profile, mode, committeesize, workers, engine, budget, cost_model)
+    function = chosen.func if isinstance(chosen, functools.partial) else chosen
+    if progress is not None and function in PROGRESS_ENGINES:
+        return functools.partial(chosen, progress=progress)
+    return chosen
+
+
+def _choose_engine(profile, mode, committeesize, workers, engine, budget, cost_model):
+    workers = workers or os.cpu_count() or 1
+    if engine != "auto":
+        if engine not in ENGINES:
+            raise Exception("This evaluation engine is unknown.")
+        if engine == "parallel":
+            return functools.partial(parallel, workers=workers)
+        if budget is not None and engine in ("exhaustive", "branch-and-bound"):
+            return functools.partial(ENGINES[engine], budget=budget)
+        return ENGINES[engine]
+    # The closed form is exact and faster than approximating.
+    if all(isinstance(entry, CompiledApprovalBallot) for entry, count in profile.entries):
+        return approval
+    if mode == "approximate":
+        return approximate
+    rows = profile.rows()
+    if rows is not None:
+        if budget is not None:
+            return functools.partial(branch_and_bound, budget=budget)
+        if committeesize is not None:
+            n = len(profile.candidates)
+            classes, rows_of_class = _symmetry_classes(rows, n)
+            if len(classes) < n and \
+                    _count_vectors([len(c) for c in classes], committeesize) * SYMMETRY_GAIN <= math.comb(n, committeesize):
+                return symmetric
+        if cost_model is not None and committeesize is not None:
+            name, seconds = cost_model.fastest_exact(len(profile.candidates), committeesize, len(rows), workers)
+            return functools.partial(parallel, workers=workers) if name == "parallel" else ENGINES[name]
+        # The vectorized engine scores every committee; pruning usually saves
+        # more, so it is only used if forced (engine="vectorized").
+        committees = math.comb(len(profile.candidates), committeesize) if committeesize is not None else 0
+        if workers > 1 and committees >= PARALLEL_THRESHOLD:
+            return functools.partial(parallel, workers=workers)
+        return branch_and_bound
+    if budget is not None:
+        return functools.partial(exhaustive, budget=budget)
+    return exhaustive
+
+
+def exhaustive(profile, committeesize, budget=None, progress=None, rng=random):
+    """
+    Score every committee. Works for all ballot types, but checks
+    ( |candidates| \\choose committeesize ) many committees.
+
+    :param budget: a Budget; committees are scored in the order of itertools.combinations
+    :param progress: called now and then with the fraction of committees covered
+    :param rng: the random number generator of the tie-break (e.g. a random.Random)
+    """
+    bits = list(profile.bits.values())
+    total = math.comb(len(bits), committeesize)
+    start = budget.start if budget is not None else 0
+    best_score = budget.incumbent if budget is not None else 0
+    ties, chosen = 0, None
+    position = start
+    for members in itertools.islice(itertools.combinations(bits, committeesize), start, None):
+        if budget is not None and budget.spend() and position > start:
+            break
+        if progress is not None and position % PROGRESS_STEPS == 0:
+            progress(position / total)
+        committee = sum(members)
+        current_score = profile.score(committee)
+        if current_score > best_score:
+            best_score, ties, chosen = current_score, 1, committee
+        elif current_score == best_score:
+            ties += 1
+            if rng.randrange(ties) == 0:
+                chosen = committee
+        position += 1
+    bound = upper_bound(profile, committeesize) if position < total else None
+    return Result(best_score, _chosen(chosen), bound, position=position, total=total, ties=ties,
+                  scored=position - start)
+
+
+def approval(profile, committeesize, rng=random):
+    """
+    Closed form for approval ballots. The score of a committee is the sum of
+    its members' approval counts, so the best committees consist of the top
+    candidates. Of the candidates tied at the boundary, a random selection
+    completes the committee; all selections are tied (e.g. every committee
+    before the first vote), so they are counted, not enumerated.
+    """
+    tallies = [0] * len(profile.candidates)
+    for entry, count in profile.entries:
+        approved = entry.approved
+        while approved:
+            bit = approved & -approved
+            tallies[bit.bit_length() - 1] += count
+            approved ^= bit
+    ranked = sorted(tallies, reverse=True)
+    threshold = ranked[committeesize - 1]
+    elected = sum(1 << i for i, tally in enumerate(tallies) if tally > threshold)
+    boundary = [1 << i for i, tally in enumerate(tallies) if tally == threshold]
+    best_score = sum(ranked[:committeesize])
+    missing = committeesize - elected.bit_count()
+    committee = elected + sum(rng.sample(boundary, missing))
+    return Result(best_score, [committee], ties=math.comb(len(boundary), missing), scored=1)
+
+
+def branch_and_bound(profile, committeesize, budget=None, progress=None, rng=random):
+    """
+    Exact search for profiles of bounded sets (see `Profile.rows`). Committees
+    are built candidate by candidate and a partial committee is dropped as
+    soon as an upper bound on its completions is below the best score found.
+    Committees reaching the best score are never dropped, so all ties are
+    counted. Two bounds are used:
+
+    - every bounded set is filled as well as its bounds and the remaining
+      candidates allow, independently of the other sets,
+    - every missing member adds at most its maximum marginal gain.
+
+    :param budget: a Budget; ranks refer to the combinations of positions in
+                   the candidate order used by the search, which is visited
+                   in lexicographic order
+    :param progress: called now and then with the fraction of committees
+                     covered, pruned ones included
+    :param rng: the random number generator of the tie-break
+    """
+    n = len(profile.candidates)
+    rows = profile.rows()
+    bits = list(profile.bits.values())
+    rows_of, candidate_gain = _candidate_gains(rows, n, committeesize)
+    gains = _gain_tables(rows)
+
+    # Best candidates first, so that good committees are found early. Then
+    # the largest gains of the remaining candidates are a contiguous range.
+    order = sorted(range(n), key=lambda i: candidate_gain[i], reverse=True)
+    prefix_gain = [0]
+    for i in order:
+        prefix_gain.append(prefix_gain[-1] + candidate_gain[i])
+    # remaining[p][r]: members of row r at positions p, p+1, ... of order.
+    remaining = [[0] * len(rows)]
+    for i in reversed(order):
+        counts = list(remaining[0])
+        for r in rows_of[i]:
+            counts[r] += 1
+        remaining.insert(0, counts)
+
+    # Start from the score of a greedily built committee. It is found again
+    # by the search, so it needs not be recorded here. A budget might stop the
+    # search before that, so then only the best score before its start is used.
+    sizes = [0] * len(rows)
+    tied = [0, None]  # the number of committees with the best score, and the chosen one
+    total = math.comb(n, committeesize)
+    start = None
+    if budget is None:
+        best = [profile.score(_greedy(profile, committeesize))]
+    else:
+        best = [budget.incumbent]
+        if budget.start >= total:
+            return Result(budget.incumbent, list(), position=total, total=total)
+        start = _unrank(budget.start, n, committeesize)
+    path = list()
+    scored = [0]
+    steps = [0]
+
+    def set_bound(p, missing):
+        total = 0
+        counts = remaining[p]
+        for r, (mask, weight, lower, saturation, upper) in enumerate(rows):
+            size = sizes[r]
+            largest = size + (missing if missing < counts[r] else counts[r])
+            if largest > upper:
+                largest = upper
+            if largest >= size and largest >= lower:
+                total += weight * (largest if largest < saturation else saturation)
+        return total
+
+    def search(p, missing, committee, current_score, on_start):
+        if missing == 0:
+            scored[0] += 1
+            if current_score > best[0]:
+                best[0] = current_score
+                tied[0], tied[1] = 1, committee
+            elif current_score == best[0]:
+                tied[0] += 1
+                if rng.randrange(tied[0]) == 0:
+                    tied[1] = committee
+            return
+        if current_score + prefix_gain[p + missing] - prefix_gain[p] < best[0]:
+            return
+        # With one member missing, scoring the children is as cheap as this bound.
+        if missing > 1 and set_bound(p, missing) < best[0]:
+            return
+        # On the path to the start of the budget, skip the committees before it.
+        first = start[len(path)] if on_start else p
+        for q in range(first, n - missing + 1):
+            # The first committee of this subtree is not after the start if
+            # still on its path, so the budget is checked only past it.
+            if budget is not None and (budget.spend() if missing == 1 else budget.expired()) \
+                    and not (on_start and q == first):
+                raise _OutOfBudget(path + list(range(q, q + missing)))
+            if progress is not None:
+                steps[0] += 1
+                if steps[0] % PROGRESS_STEPS == 0:
+                    progress(_rank(path + list(range(q, q + missing)), n) / total)
+            i = order[q]
+            delta = 0
+            for r in rows_of[i]:
+                size = sizes[r]
+                sizes[r] = size + 1
+                delta += gains[r][size]
+            path.append(q)
+            search(q + 1, missing - 1, committee | bits[i], current_score + delta, on_start and q == first)
+            path.pop()
+            for r in rows_of[i]:
+                sizes[r] -= 1
+
+    try:
+        search(0, committeesize, 0, 0, start is not None)
+    except _OutOfBudget as stop:
+        position = _rank(stop.members, n)
+        return Result(best[0], _chosen(tied[1]), upper_bound(profile, committeesize),
+                      position=position, total=total, ties=tied[0], scored=scored[0])
+    return Result(best[0], _chosen(tied[1]), ties=tied[0], scored=scored[0])
+
+
+def parallel(profile, committeesize, workers=0, progress=None, rng=random):
+    """
+    Score every committee like `exhaustive`, spread over several processes.
+    The committees, in the order of itertools.combinations, are split into
+    contiguous ranges of ranks; each worker finds the first committee of its
+    range by unranking (combinatorial number system) and scores the range on
+    the profile's rows (see `Profile.rows`). The best scores and ties of all
+    ranges are merged afterwards, each range's chosen committee standing
+    for its ties.
+
+    The processes are started once (see `_get_pool`) and reused by later
+    evaluations.
+
+    :param workers: number of processes (0: all cores)
+    :param progress: called with the fraction of committees scored after each range
+    :param rng: the random number generator of the tie-break; the workers
+                get seeds drawn from it
+    """
+    rows = profile.rows()
+    n = len(profile.candidates)
+    total = math.comb(n, committeesize)
+    workers = workers or os.cpu_count() or 1
+    shards = min(total, 4 * workers)  # more ranges than workers evens out their runtimes
+    starts = [total * s // shards for s in range(shards + 1)]
+    pool = _get_pool(workers)
+    futures = [pool.submit(_score_range, rows, n, committeesize, starts[s], starts[s + 1] - starts[s],
+                           rng.getrandbits(64))
+               for s in range(shards)]
+    results = list()
+    for future in futures:
+        results.append(future.result())
+        if progress is not None:
+            progress(starts[len(results)] / total)
+    best_score = max([score for score, count, committee in results] + [0])
+    ties, chosen = 0, None
+    for score, count, committee in results:
+        if score == best_score and count:
+            ties += count
+            if rng.randrange(ties) < count:
+                chosen = committee
+    return Result(best_score, _chosen(chosen), ties=ties, scored=total)
+
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    """
+    The process pool of `parallel`, created on first use. Its processes are
+    spawned, not forked: a fork would copy the caller's threads' state, e.g.
+    open database connections, into the workers.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _score_range(rows, n, committeesize, start, count, seed=None):
+    """
+    Score `count` committees, starting with the one of rank `start`.
+    Runs in a worker process of `parallel`.
+
+    :return: a tuple (best score, number of ties, chosen committee)
+    """
+    rng = random.Random(seed)
+    tables = [(mask, contribution_table(mask, lower, saturation, upper, weight))
+              for mask, weight, lower, saturation, upper in rows]
+    members = _unrank(start, n, committeesize)
+    best_score = 0
+    ties, chosen = 0, None
+    for _ in range(count):
+        committee = sum(1 << i for i in members)
+        current_score = 0
+        for mask, table in tables:
+            current_score += table[(mask & committee).bit_count()]
+        if current_score > best_score:
+            best_score, ties, chosen = current_score, 1, committee
+        elif current_score == best_score:
+            ties += 1
+            if rng.randrange(ties) == 0:
+                chosen = committee
+        _advance(members, n)
+    return best_score, ties, chosen
+
+
+def _unrank(rank, n, k):
+    """
+    The k-combination of range(n) at position rank in lexicographic order.
+    """
+    members = list()
+    x = 0
+    for missing in range(k, 0, -1):
+        while rank >= math.comb(n - x - 1, missing - 1):
+            rank -= math.comb(n - x - 1, missing - 1)
+            x += 1
+        members.append(x)
+        x += 1
+    return members
+
+
+def _rank(members, n):
+    """
+    The position of a k-combination of range(n) in lexicographic order
+    (inverse of `_unrank`).
+    """
+    k = len(members)
+    rank = 0
+    x = 0
+    for j, member in enumerate(members):
+        for y in range(x, member):
+            rank += math.comb(n - y - 1, k - j - 1)
+        x = member + 1
+    return rank
+
+
+def _advance(members, n):
+    """
+    Replace members by the next combination in lexicographic order.
+
+    :return: False if members was the last combination.
+    """
+    k = len(members)
+    i = k - 1
+    while i >= 0 and members[i] == n - k + i:
+        i -= 1
+    if i < 0:
+        return False
+    members[i] += 1
+    for j in range(i + 1, k):
+        members[j] = members[j - 1] + 1
+    return True
+
+
+def vectorized(profile, committeesize, progress=None, rng=random):
+    """
+    Score every committee like `exhaustive`, but in batches with NumPy
+    (optional dependency). The profile's rows form a rows x candidates
+    incidence matrix; a batch of committees is a batch x candidates 0/1
+    matrix, so one matrix product yields all intersection sizes, to which the
+    bounds are applied element-wise.
+
+    :param progress: called with the fraction of committees scored after each batch
+    :param rng: the random number generator of the tie-break
+    """
+    if numpy is None:
+        raise Exception("The vectorized engine requires NumPy.")
+    rows = profile.rows()
+    n = len(profile.candidates)
+    # Floats let the products run through BLAS; all values are small integers, so they stay exact.
+    incidence = numpy.zeros((n, len(rows)))
+    for r, (mask, weight, lower, saturation, upper) in enumerate(rows):
+        for i in range(n):
+            if mask >> i & 1:
+                incidence[i, r] = 1
+    weight, lower, saturation, upper = (numpy.array([row[j] for row in rows], dtype=float) for j in range(1, 5))
+
+    batch_size = max(1, min(65536, 2 ** 22 // max(1, len(rows))))
+    combinations = itertools.combinations(range(n), committeesize)
+    total = math.comb(n, committeesize)
+    best_score = 0
+    ties, chosen = 0, None
+    scored = 0
+    while True:
+        batch = numpy.fromiter(itertools.chain.from_iterable(itertools.islice(combinations, batch_size)),
+                               dtype=numpy.int64)
+        if batch.size == 0:
+            break
+        batch = batch.reshape(-1, committeesize)
+        scored += len(batch)
+        if progress is not None:
+            progress(scored / total)
+        membership = numpy.zeros((len(batch), n))
+        numpy.put_along_axis(membership, batch, 1, axis=1)
+        sizes = membership @ incidence
+        contributions = numpy.where((sizes >= lower) & (sizes <= upper), numpy.minimum(sizes, saturation), 0)
+        scores = contributions @ weight
+        batch_best = round(scores.max())
+        if batch_best < best_score:
+            continue
+        if batch_best > best_score:
+            best_score, ties = batch_best, 0
+        best = batch[scores == best_score]
+        ties += len(best)
+        if rng.randrange(ties) < len(best):
+            chosen = sum(1 << int(i) for i in best[rng.randrange(len(best))])
+    return Result(best_score, _chosen(chosen), ties=ties, scored=scored)
+
+
+def revolving_door(profile, committeesize, rng=random):
+    """
+    Score every committee like `exhaustive`, but in revolving-door order,
+    where each committee differs from the previous one by swapping a single
+    member. The intersection sizes are updated for the rows (see
+    `Profile.rows`) of the two swapped candidates only, so a step costs as much
+    as these candidates appear in ballots, not as much as there are ballots.
+    """
+    n = len(profile.candidates)
+    if committeesize > n:
+        return Result(0, list())
+    rows = profile.rows()
+    rows_of, candidate_gain = _candidate_gains(rows, n, committeesize)
+    gains = _gain_tables(rows)
+    sizes = [0] * len(rows)
+    committee = (1 << committeesize) - 1
+    for i in range(committeesize):
+        for r in rows_of[i]:
+            sizes[r] += 1
+    current_score = sum(weight * contribution(sizes[r], lower, saturation, upper)
+                        for r, (mask, weight, lower, saturation, upper) in enumerate(rows))
+    best_score = current_score
+    ties, chosen = 1, committee
+    scored = 1
+    for leaving, joining in _revolving_door(n, committeesize):
+        for r in rows_of[leaving]:
+            size = sizes[r] - 1
+            sizes[r] = size
+            current_score -= gains[r][size]
+        for r in rows_of[joining]:
+            size = sizes[r]
+            sizes[r] = size + 1
+            current_score += gains[r][size]
+        committee ^= 1 << leaving | 1 << joining
+        scored += 1
+        if current_score > best_score:
+            best_score, ties, chosen = current_score, 1, committee
+        elif current_score == best_score:
+            ties += 1
+            if rng.randrange(ties) == 0:
+                chosen = committee
+    return Result(best_score, [chosen], ties=ties, scored=scored)
+
+
+def _revolving_door(n, k):
+    """
+    The k-combinations of range(n) in revolving-door order, starting with
+    range(k) (Knuth, TAOCP 7.2.1.3, Algorithm R).
+
+    :return: a generator of swaps (leaving, joining)
+    """
+    if k == 0:
+        return
+    c = [None] + list(range(k)) + [n]  # c[1..k] is the combination
+    while True:
+        if k % 2 == 1:
+            if c[1] + 1 < c[2]:
+                yield c[1], c[1] + 1
+                c[1] += 1
+                continue
+            j, increase = 2, False
+        else:
+            if c[1] > 0:
+                yield c[1], c[1] - 1
+                c[1] -= 1
+                continue
+            j, increase = 2, True
+        while True:
+            if j > k:
+                return
+            if not increase:
+                if c[j] >= j:  # decrease c[j]
+                    leaving = c[j]
+                    c[j], c[j - 1] = c[j - 1], j - 2
+                    yield leaving, j - 2
+                    break
+                j, increase = j + 1, True
+            else:
+                if c[j] + 1 < c[j + 1]:  # increase c[j]
+                    leaving = c[j - 1]
+                    c[j - 1], c[j] = c[j], c[j] + 1
+                    yield leaving, c[j]
+                    break
+                j, increase = j + 1, False
+
+
+def symmetric(profile, committeesize, rng=random):
+    """
+    Exact search for profiles of bounded sets (see `Profile.rows`) with
+    interchangeable candidates, e.g. candidates nobody voted for. Candidates
+    contained in exactly the same rows form a class (see `_symmetry_classes`),
+    and the score of a committee only depends on how many members it takes
+    from each class. So the vectors of these counts are enumerated instead
+    of the committees. Each vector stands for prod_c ( |c| \\choose count_c )
+    committees; ties are counted accordingly, and the winner is drawn from a
+    best vector, weighted by that number, with uniformly chosen members of
+    each class.
+    """
+    n = len(profile.candidates)
+    if committeesize > n:
+        return Result(0, list())
+    rows = profile.rows()
+    classes, rows_of_class = _symmetry_classes(rows, n)
+    tables = [contribution_table(mask, lower, saturation, upper, weight)
+              for mask, weight, lower, saturation, upper in rows]
+    capacity = [0] * (len(classes) + 1)  # capacity[c]: the candidates in classes c, c+1, ...
+    for c in reversed(range(len(classes))):
+        capacity[c] = capacity[c + 1] + len(classes[c])
+    sizes = [0] * len(rows)
+    counts = [0] * len(classes)
+    best = [None]
+    tied = [0, None]  # the number of committees with the best score, and the counts chosen
+    scored = [0]
+
+    def search(c, missing, multiplicity):
+        if c == len(classes):
+            scored[0] += 1
+            current_score = sum(table[size] for table, size in zip(tables, sizes))
+            if best[0] is None or current_score > best[0]:
+                best[0] = current_score
+                tied[0], tied[1] = multiplicity, list(counts)
+            elif current_score == best[0]:
+                tied[0] += multiplicity
+                if rng.randrange(tied[0]) < multiplicity:
+                    tied[1] = list(counts)
+            return
+        # Leave enough members for the later classes to fill the committee.
+        for count in range(max(0, missing - capacity[c + 1]), min(len(classes[c]), missing) + 1):
+            counts[c] = count
+            for r in rows_of_class[c]:
+                sizes[r] += count
+            search(c + 1, missing - count, multiplicity * math.comb(len(classes[c]), count))
+            for r in rows_of_class[c]:
+                sizes[r] -= count
+        counts[c] = 0
+
+    search(0, committeesize, 1)
+    committee = sum(sum(rng.sample(members, count)) for members, count in zip(classes, tied[1]))
+    return Result(best[0], [committee], ties=tied[0], scored=scored[0])
+
+
+def _symmetry_classes(rows, n):
+    """
+    Partition the candidates into classes of candidates contained in exactly
+    the same rows, which are interchangeable in every committee.
+
+    :return: a tuple (the classes as lists of candidate bits, the rows of each class)
+    """
+    rows_of = [list() for _ in range(n)]
+    for r, (mask, weight, lower, saturation, upper) in enumerate(rows):
+        for i in range(n):
+            if mask >> i & 1:
+                rows_of[i].append(r)
+    classes = dict()
+    for i in range(n):
+        classes.setdefault(tuple(rows_of[i]), list()).append(1 << i)
+    return list(classes.values()), [list(key) for key in classes]
+
+
+def _count_vectors(class_sizes, k):
+    """
+    The number of ways to take k members from classes of the given sizes,
+    counting only how many are taken from each class.
+    """
+    ways = [1] + [0] * k  # ways[j]: the vectors taking j members from the classes so far
+    for size in class_sizes:
+        ways = [sum(ways[j - t] for t in range(min(size, j) + 1)) for j in range(k + 1)]
+    return ways[k]
+
+
+def approximate(profile, committeesize, rng=random):
+    """
+    Fast, but not necessarily optimal: builds a committee greedily by marginal
+    gain and improves it by swapping single members while the score increases.
+    The result reports an upper bound (see `upper_bound`) on the optimal score.
+
+    :param rng: not needed, the search is deterministic
+    """
+    bits = list(profile.bits.values())
+    committee = _greedy(profile, committeesize)
+    current_score = profile.score(committee)
+    scored = committeesize * len(bits) + 1  # by the greedy start
+    improved = True
+    while improved:
+        improved = False
+        for leaving in (bit for bit in bits if committee & bit):
+            for joining in (bit for bit in bits if not committee & bit):
+                swapped = committee ^ leaving | joining
+                swapped_score = profile.score(swapped)
+                scored += 1
+                if swapped_score > current_score:
+                    committee, current_score = swapped, swapped_score
+                    improved = True
+                    break
+            if improved:
+                break
+    return Result(current_score, [committee], upper_bound(profile, committeesize), exact=False, scored=scored)
+
+
+def upper_bound(profile, committeesize):
+    """
+    An upper bound on the best score of any committee, from the bounds used by
+    `branch_and_bound` at its root.
+
+    :return: a number, or None if the profile has no compiled rows.
+    """
+    rows = profile.rows()
+    if rows is None:
+        return None
+    rows_of, candidate_gain = _candidate_gains(rows, len(profile.candidates), committeesize)
+    gain_bound = sum(sorted(candidate_gain, reverse=True)[:committeesize])
+    set_bound = 0
+    for mask, weight, lower, saturation, upper in rows:
+        largest = min(committeesize, mask.bit_count(), upper)
+        if largest >= lower:
+            set_bound += weight * min(largest, saturation)
+    return min(gain_bound, set_bound)
+
+
+def _greedy(profile, committeesize):
+    committee = 0
+    bits = list(profile.bits.values())
+    for _ in range(committeesize):
+        committee = max((committee | bit for bit in bits if not committee & bit), key=profile.score)
+    return committee
+
+
+def _gain_tables(rows):
+    """
+    For each row, how much its weighted contribution grows when the
+    intersection grows from size s to s + 1, for s = 0, ..., |mask| - 1.
+    """
+    gains = list()
+    for mask, weight, lower, saturation, upper in rows:
+        table = contribution_table(mask, lower, saturation, upper, weight)
+        gains.append([table[size + 1] - table[size] for size in range(len(table) - 1)])
+    return gains
+
+
+def _candidate_gains(rows, n, committeesize):
+    """
+    For each candidate, the rows containing it and an upper bound on how much
+    adding it to any committee can increase the score.
+    """
+    rows_of = [list() for _ in range(n)]
+    candidate_gain = [0] * n
+    for r, (mask, weight, lower, saturation, upper) in enumerate(rows):
+        steps = range(1, min(mask.bit_count(), committeesize) + 1)
+        gain = max([contribution(t, lower, saturation, upper) - contribution(t - 1, lower, saturation, upper)
+                    for t in steps] + [0])
+        for i in range(n):
+            if mask >> i & 1:
+                rows_of[i].append(r)
+                candidate_gain[i] += weight * gain
+    return rows_of, candidate_gain
+
+
+ENGINES = {
+    "exhaustive": exhaustive,
+    "approval": approval,
+    "branch-and-bound": branch_and_bound,
+    "parallel": parallel,
+    "vectorized": vectorized,
+    "revolving-door": revolving_door,
+    "symmetric": symmetric,
+    "approximate": approximate,
+}
+
+# The engines taking a `progress` function.
+PROGRESS_ENGINES = [exhaustive, branch_and_bound, parallel, vectorized]
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Parsers of ballot files, for importing ballots (`flask goodvotex import-ballots`).
+Every parser reads its file line by line and yields ImportedLine tuples, so
+files of any size can be imported. The ballots are JSON objects as posted to
+`/vote/<electionID>`. Candidates are given by their names or their ids; names
+take precedence.
+
+- csv: one ballot per row. For approval ballots, the cells are the approved
+  candidates. For bounded approval ballots, each cell is one bounded set
+  `a|b|c:lower:saturation:upper`.
+- jsonl: one ballot per line, as posted to `/vote/<electionID>`; the type may
+  be left out, and an optional "count" tells how often the ballot was cast.
+- preflib: approval ballots in the PrefLib format for categorical preferences
+  (.cat), e.g. `12: {1,3},{2,4}` for 12 voters approving of the first category.
+  Lines without categories, e.g. `12: 1,3`, approve of all listed candidates.
+  The candidates are numbered by the `# ALTERNATIVE NAME i: name` lines.
+"""
+import csv
+import json
+import re
+from collections import namedtuple
+
+# line: the line number in the file; ballot: the ballot as JSON object, or
+# None if the line cannot be parsed; count: how often the ballot was cast;
+# error: why the line cannot be parsed
+ImportedLine = namedtuple("ImportedLine", ["line", "ballot", "count", "error"])
+
+EXTENSIONS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".json": "jsonl",
+    ".cat": "preflib",
+    ".toc": "preflib",
+    ".soi": "preflib",
+}
+
+
+def guess_format(filename):
+    """
+    :return: the format of a file by its extension (see EXTENSIONS)
+    """
+    for extension, file_format in EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return file_format
+    raise Exception("The format of '%s' is unknown. Choose one of csv, jsonl or preflib." % filename)
+
+
+def parse(lines, file_format, ballot_type, candidates):
+    """
+    Parses a ballot file.
+
+    :param lines: the lines of the file, e.g. the open file
+    :param file_format: "csv", "jsonl" or "preflib"
+    :param ballot_type: the ballot type of the election
+    :param candidates: a dict from the candidate names of the election to their ids (as strings)
+    :return: a generator of ImportedLine
+    """
+    parsers = {
+        "csv": parse_csv,
+        "jsonl": parse_jsonl,
+        "preflib": parse_preflib,
+    }
+    if file_format not in parsers:
+        raise Exception("The format '%s' is unknown. Choose one of csv, jsonl or preflib." % file_format)
+    if file_format == "preflib" and ballot_type != "approvalBallot":
+        raise Exception("PrefLib files only hold approval ballots.")
+    resolve = _resolver(candidates)
+    for line, content in parsers[file_format](lines, ballot_type, resolve):
+        if isinstance(content, Exception):
+            yield ImportedLine(line, None, 0, str(content))
+        else:
+            ballot, count = content
+            yield ImportedLine(line, ballot, count, None)
+
+
+def parse_csv(lines, ballot_type, resolve):
+    for line, row in enumerate(csv.reader(lines), 1):
+        cells = [cell.strip() for cell in row if cell.strip()]
+        if not cells:
+            continue
+        try:
+            if ballot_type == "approvalBallot":
+                yield line, ({"type": ballot_type, "app_candidates": [resolve(c) for c in cells]}, 1)
+            else:
+                sets, bounds = dict(), dict()
+                for i, cell in enumerate(cells):
+                    members, lower, saturation, upper = cell.rsplit(":", 3)
+                    sets[str(i)] = [resolve(c.strip()) for c in members.split("|") if c.strip()]
+                    bounds[str(i)] = [int(lower), int(saturation), int(upper)]
+                yield line, ({"type": ballot_type, "sets": sets, "bounds": bounds}, 1)
+        except ValueError:
+            yield line, Exception("Bounded sets must be written as a|b|c:lower:saturation:upper.")
+
+
+def parse_jsonl(lines, ballot_type, resolve):
+    for line, text in enumerate(lines, 1):
+        if not text.strip():
+            continue
+        try:
+            ballot = json.loads(text)
+            if not isinstance(ballot, dict):
+                raise ValueError()
+        except ValueError:
+            yield line, Exception("This line is not a JSON object.")
+            continue
+        count = ballot.pop("count", 1)
+        ballot.setdefault("type", ballot_type)
+        if isinstance(ballot.get("app_candidates"), list):
+            ballot["app_candidates"] = [resolve(str(c)) for c in ballot["app_candidates"]]
+        if isinstance(ballot.get("sets"), dict):
+            ballot["sets"] = {key: [resolve(str(c)) for c in members] for key, members in ballot["sets"].items()}
+        if not isinstance(count, int) or count < 1:
+            yield line, Exception("The count must be a positive integer.")
+            continue
+        yield line, (ballot, count)
+
+
+_PREFLIB_NAME = re.compile(r"#\s*ALTERNATIVE NAME (\d+):\s*(.*)")
+_PREFLIB_CATEGORY = re.compile(r"\{([^}]*)\}")
+
+
+def parse_preflib(lines, ballot_type, resolve):
+    alternatives = dict()
+    for line, text in enumerate(lines, 1):
+        text = text.strip()
+        if not text:
+            continue
+        if text.startswith("#"):
+            match = _PREFLIB_NAME.match(text)
+            if match:
+                alternatives[match.group(1)] = match.group(2).strip()
+            continue
+        try:
+            count, preferences = text.split(":", 1)
+            count = int(count)
+            if count < 1:
+                raise ValueError()
+        except ValueError:
+            yield line, Exception("Lines must be written as count: {approved},{not approved}.")
+            continue
+        # The first category holds the approved alternatives; without
+        # categories, all listed alternatives are approved.
+        first = _PREFLIB_CATEGORY.search(preferences)
+        approved = (first.group(1) if first is not None else preferences).split(",")
+        approved = [resolve(alternatives.get(a.strip(), a.strip())) for a in approved if a.strip()]
+        yield line, ({"type": ballot_type, "app_candidates": approved}, count)
+
+
+def _resolver(candidates):
+    def resolve(candidate):
+        # Ids and unknown candidates are kept; the latter are rejected when the ballot is checked.
+        return candidates.get(candidate, candidate)
+    return resolve
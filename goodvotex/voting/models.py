@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
-import itertools
+import datetime
 import json
 import random
 import re
 
 from sqlalchemy import ForeignKey
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapped, mapped_column, object_session
 
 from .. import db
+from . import engines
+from .stats import EvaluationStats
+from .profile import Profile, CompiledBallot, CompiledApprovalBallot, CompiledBoundedApprovalBallot, contribution
 
 
 class Election(db.Model):
@@ -20,6 +24,19 @@ class Election(db.Model):
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     owner = db.relationship('User', backref=db.backref('elections', lazy=True))
     ballot_type = db.Column(db.String(60), nullable=False)
+    evaluation_mode = db.Column(db.String(20), default="exact")
+    winner_score = db.Column(db.Float)
+    winner_score_bound = db.Column(db.Float)
+    winner_ties = db.Column(db.Integer)
+    # Seeds the random tie-break, so that results can be reproduced (None: unseeded).
+    tiebreak_seed = db.Column(db.Integer)
+    # The vote count and evaluation mode the stored winners were computed for.
+    result_votecount = db.Column(db.Integer)
+    result_mode = db.Column(db.String(20))
+    # Set while an evaluation stopped by its budget can be resumed (see `recompute_current_winner`).
+    result_provisional = db.Column(db.Boolean, default=False)
+    result_position = db.Column(db.Integer)
+    result_coverage = db.Column(db.Float)
 
     def __eq__(self, other):
         try:
@@ -37,26 +54,149 @@ class Election(db.Model):
         """
         if self.is_stopped:
             raise Exception("The creator stopped the voting process. You can no longer vote.")
+        Election.check_ballot(ballot, self.ballot_type, {str(c.id) for c in self.candidates})
         self.ballots.append(ballot)
-        if not ballot.is_of_type(self.ballot_type):
+        self._count_pattern(ballot.type, ballot.json_encoded, 1)
+        self.votecount += 1
+
+    @staticmethod
+    def check_ballot(ballot, ballot_type, candidate_ids):
+        """
+        Checks that an election accepts a ballot, without loading the election.
+
+        :param ballot:
+        :param ballot_type: the ballot type of the election
+        :param candidate_ids: the ids of the candidates of the election, as strings
+        :return:
+        """
+        if not ballot.is_of_type(ballot_type):
             raise Exception("This election does not accept this type of ballot.")
-        if len(ballot.get_involved_candidates().difference([str(c.id) for c in self.candidates])) > 0:
-            self.ballots.remove(ballot)
+        if len(ballot.get_involved_candidates().difference(candidate_ids)) > 0:
             raise Exception("Ballot seems to involve candidates not participating in this election.")
-        self.votecount += 1
 
-    def recompute_current_winner(self):
+    def recount(self):
+        """
+        Recounts all ballots and replaces the running tallies (see
+        `BallotPattern`) if they do not match. Winner computation only reads
+        the tallies, so this is an integrity check which loads all ballots.
+
+        :return: True if the tallies were correct.
+        """
+        counts = dict()
+        for ballot in self.ballots:
+            key = (ballot.type, ballot.json_encoded)
+            counts[key] = counts.get(key, 0) + 1
+        if counts == {(p.ballot_type, p.json_encoded): p.count for p in self.patterns if p.count}:
+            return True
+        self.patterns = [BallotPattern(ballot_type=t, json_encoded=j, count=c) for (t, j), c in counts.items()]
+        return False
+
+    def recompute_current_winner(self, time_budget=None, committee_budget=None, mode=None, stats=None, **options):
         """
         Recomputes the currently best committee.
-        Note that this should be called as rarely as possible, as it checks
-        all ( |candidates| \choose committeesize ) many committees' scores.
+        Note that this should be called as rarely as possible, as it may check
+        all ( |candidates| \choose committeesize ) many committees' scores
+        (see `engines.choose_engine`). In the evaluation mode `approximate`
+        the committee might not be optimal; `winner_score_bound` then tells how
+        good the best committee could be.
+
+        With a budget, the search stops when the budget is used up and the best
+        committee found so far is stored as provisional result, together with
+        the fraction of committees covered (`result_coverage`). The next call
+        for the same votes continues where the last one stopped.
+
+        Ties are broken uniformly at random; `winner_ties` tells among how
+        many committees. With a `tiebreak_seed`, the same votes, evaluation
+        engine and budgets always give the same winners.
+
+        :param time_budget: seconds the search may take (None: unlimited)
+        :param committee_budget: number of committees the search may score (None: unlimited)
+        :param mode: the evaluation mode of this computation (None: `evaluation_mode`)
+        :param stats: an EvaluationStats recording timings and counters (optional)
+        :param options: passed on to `engines.choose_engine`, e.g. `workers`
+        :return:
+        """
+        mode = mode or self.evaluation_mode or "exact"
+        budget = None
+        if time_budget or committee_budget:
+            resume = self.can_resume()
+            budget = engines.Budget(time_budget, committee_budget,
+                                    start=self.result_position if resume else 0,
+                                    incumbent=self.winner_score if resume else 0)
+        rng = self.tiebreak_rng()
+        result = self._compute_winner(mode, stats or EvaluationStats(), rng, budget=budget, **options)
+        winner_ids = {str(c.id) for c in result.winner} if result.winner is not None else set()
+        ties = result.ties
+        if budget is not None and budget.start > 0:
+            # Merge with the committees found before the start of this budget,
+            # each tied committee being equally likely to win.
+            previous_ties = self.winner_ties if result.score == self.winner_score else 0
+            if not result.committees or rng.randrange(previous_ties + ties) < previous_ties:
+                winner_ids = {str(c.id) for c in self.get_winners()}
+            ties += previous_ties
+        self.set_result(winner_ids, result.score, result.upper_bound, ties, mode)
+        self.result_provisional = not result.complete
+        self.result_position = None if result.complete else result.position
+        self.result_coverage = result.coverage
+
+    def set_result(self, winner_ids, score, score_bound, ties, mode=None):
+        """
+        Stores the result of an evaluation for the current votes.
 
+        :param winner_ids: the ids of the winning candidates
+        :param score: the score of the winning committee
+        :param score_bound: an upper bound on the best score
+        :param ties: the number of committees with the best score found
+        :param mode: the evaluation mode the result was computed in (None: `evaluation_mode`)
         :return:
         """
         for c in self.candidates:
-            c.is_winner = False
-        for w in self._compute_winner():
-            w.is_winner = True
+            c.is_winner = str(c.id) in winner_ids
+        self.winner_score = score
+        self.winner_score_bound = score_bound
+        self.winner_ties = ties
+        self.result_votecount = self.votecount
+        self.result_mode = mode or self.evaluation_mode or "exact"
+        self.result_provisional = False
+        self.result_position = None
+        self.result_coverage = 1.0
+
+    def get_result(self):
+        """
+        The stored result, in the form taken by `set_result`.
+
+        :return: a tuple (winner_ids, score, score_bound, ties, mode)
+        """
+        return frozenset(str(c.id) for c in self.get_winners()), self.winner_score, self.winner_score_bound, \
+            self.winner_ties, self.result_mode
+
+    def has_current_result(self):
+        """
+        Whether the stored result is final and was computed for the current votes.
+
+        :return: True/False
+        """
+        return self._result_is_for_current_votes() and not self.result_provisional
+
+    def can_resume(self):
+        """
+        Whether the stored result is provisional and its evaluation can be
+        continued (see `recompute_current_winner`).
+
+        :return: True/False
+        """
+        return self._result_is_for_current_votes() and bool(self.result_provisional) \
+            and self.result_position is not None
+
+    def tiebreak_rng(self):
+        """
+        The random number generator for breaking ties between committees.
+
+        :return: a random.Random seeded with `tiebreak_seed` and the vote count, or the random module if unseeded
+        """
+        if self.tiebreak_seed is None:
+            return random
+        return random.Random("%d-%d" % (self.tiebreak_seed, self.votecount))
 
     def get_winners(self):
         """
@@ -98,23 +238,48 @@ class Election(db.Model):
             raise Exception("Search is empty.")
         return len(words.intersection(self._get_keywords()))
 
-    def _compute_winner(self):
-        best_score = 0
-        committees_with_score = list()
-        for committee in itertools.combinations(self.candidates, self.committeesize):
-            current_score = self._score(committee)
-            if current_score > best_score:
-                best_score = current_score
-                committees_with_score = list()
-                committees_with_score.append(committee)
-            elif current_score == best_score:
-                committees_with_score.append(committee)
-        ret = random.choice(committees_with_score)
-        return ret
+    def _result_is_for_current_votes(self):
+        # Exact elections may be evaluated approximately if they got too many votes.
+        return self.result_votecount == self.votecount \
+            and self.result_mode in (self.evaluation_mode or "exact", "approximate")
+
+    def _compute_winner(self, mode, stats, rng, **options):
+        with stats.phase("load"):
+            if not self.patterns or sum(p.count for p in self.patterns) != self.votecount:
+                self.recount()  # elections from before running tallies were kept
+            patterns = list(self.patterns)
+            candidates = list(self.candidates)
+        with stats.phase("decode"):
+            profile = Profile(candidates, patterns=patterns)
+        stats.count("ballots", profile.ballot_count)
+        stats.count("distinct_ballots", len(profile.entries))
+        with stats.phase("search"):
+            engine = engines.choose_engine(profile, mode, self.committeesize, **options)
+            result = engine(profile, self.committeesize, rng=rng)
+        stats.count("committees_scored", result.scored)
+        stats.count("ties", result.ties)
+        with stats.phase("tie-break"):
+            result.winner = profile.members(result.committees[0]) if result.committees else None
+        return result
 
     def _score(self, committee):
         return sum(ballot.score({str(c.id) for c in committee}) for ballot in self.ballots)
 
+    def _count_pattern(self, ballot_type, json_encoded, count):
+        session = object_session(self)
+        if session is not None and self.id is not None:
+            count_pattern(session, self.id, ballot_type, json_encoded, count)
+            if 'patterns' in self.__dict__:
+                for pattern in self.patterns:
+                    session.expire(pattern)
+                session.expire(self, ['patterns'])
+            return
+        for pattern in self.patterns:
+            if pattern.ballot_type == ballot_type and pattern.json_encoded == json_encoded:
+                pattern.count += count
+                return
+        self.patterns.append(BallotPattern(ballot_type=ballot_type, json_encoded=json_encoded, count=count))
+
     def _get_keywords(self):
         if not hasattr(self, 'keywords'):
             keywords = self.title.lower() + " " + self.description.lower() + " " + str(self.id)
@@ -126,6 +291,27 @@ class Election(db.Model):
         return self.keywords
 
 
+def count_pattern(session, election_id, ballot_type, json_encoded, count):
+    """
+    Adds `count` to the running tally of ballots with this content (see
+    `BallotPattern`). Concurrent votes must neither lose an increment nor
+    insert the same pattern twice, so the database adds the count (upsert).
+
+    :param session:
+    :param election_id:
+    :param ballot_type:
+    :param json_encoded:
+    :param count:
+    :return:
+    """
+    session.execute(
+        sqlite_insert(BallotPattern)
+        .values(election_id=election_id, ballot_type=ballot_type, json_encoded=json_encoded, count=count)
+        .on_conflict_do_update(index_elements=['election_id', 'ballot_type', 'json_encoded'],
+                               set_={'count': BallotPattern.count + count})
+    )
+
+
 class Candidate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60), nullable=False)
@@ -134,6 +320,56 @@ class Candidate(db.Model):
     is_winner = db.Column(db.Boolean, default=False)
 
 
+class EvaluationJob(db.Model):
+    """
+    A request to compute the winners of an election, run by the worker
+    (`flask goodvotex worker`) instead of the web server. There is at most one
+    job per election and vote count, so repeated requests share one job.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    election_id = db.Column(db.Integer, db.ForeignKey('election.id'), nullable=False)
+    election = db.relationship('Election', backref=db.backref('jobs', lazy=True, cascade="all, delete-orphan"))
+    votecount = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default="pending")  # pending, running, done or failed
+    error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Fraction of the committees checked so far, and the EvaluationStats of the run as JSON.
+    progress = db.Column(db.Float, default=0)
+    stats = db.Column(db.Text)
+
+    __table_args__ = (db.UniqueConstraint('election_id', 'votecount'),)
+
+    def is_finished(self):
+        return self.status in ["done", "failed"]
+
+
+class BallotPattern(db.Model):
+    """
+    Running tally: how many ballots of an election have exactly this content.
+    It is updated with every vote, so winners are computed from the distinct
+    ballots and their counts without reading the ballots table.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    election_id = db.Column(db.Integer, db.ForeignKey('election.id'), nullable=False)
+    election = db.relationship('Election', backref=db.backref('patterns', lazy=True, cascade="all, delete-orphan"))
+    ballot_type = db.Column(db.String(60), nullable=False)
+    json_encoded = db.Column(db.String(1000), nullable=False)
+    count = db.Column(db.Integer, default=0)
+
+    __table_args__ = (db.UniqueConstraint('election_id', 'ballot_type', 'json_encoded'),)
+
+    def to_ballot(self):
+        """
+        A ballot with the content of this pattern. It is not added to any election.
+
+        :return: a Ballot
+        """
+        ballot_class = Ballot.__mapper__.polymorphic_map[self.ballot_type].class_
+        return ballot_class(json_encoded=self.json_encoded)
+
+
 class Ballot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     type: Mapped[str]
@@ -146,9 +382,10 @@ class Ballot(db.Model):
         "polymorphic_on": "type",
     }
 
-    def __init__(self, json_content, **kwargs):
+    def __init__(self, json_content=None, **kwargs):
         super(Ballot, self).__init__(**kwargs)
-        self._parse_from_json(json_content)
+        if json_content is not None:
+            self._parse_from_json(json_content)
         if not self._check_validity():
             raise Exception("Ballot does not seem to be valid.") 
 
@@ -166,6 +403,19 @@ class Ballot(db.Model):
         """
         pass
 
+    # Optional Overwrite.
+    def compile(self, profile):
+        """
+        Decode this ballot into a compact in-memory form which can score
+        committees without touching the database columns again. The winner
+        computation compiles every ballot once and then only uses the compiled
+        form. The default wraps `score`, so overwriting is only needed for speed.
+
+        :param profile: the Profile, which maps candidate ids to bits
+        :return: an object with a method `score(committee)` taking a bitmask
+        """
+        return CompiledBallot(self, profile)
+
     # Optional Overwrite.
     def _check_validity(self):
         """
@@ -235,7 +485,10 @@ class BoundedApprovalBallot(Ballot):
 
     def score(self, committee):
         sets = self._decode()
-        return sum(bs.phi(committee) * bs.intersection_size(committee) for bs in sets)
+        return sum(bs.contribution(bs.intersection_size(committee)) for bs in sets)
+
+    def compile(self, profile):
+        return CompiledBoundedApprovalBallot(self._decode(), profile)
 
     def _check_validity(self):
         sets = self._decode()
@@ -257,6 +510,8 @@ class BoundedApprovalBallot(Ballot):
             if len(items_in_set) == 0:
                 continue
             bounded_sets.append(BoundedSet(bounds[s][0], bounds[s][1], bounds[s][2], items_in_set))
+        # Sorted, so that ballots with the same content have the same encoding.
+        bounded_sets = sorted(bounded_sets, key=lambda bs: sorted(str(c) for c in bs))
         bounded_sets_encoded = {"bsets": [bs.serialize() for bs in bounded_sets]}
         self.json_encoded = json.dumps(bounded_sets_encoded)
     
@@ -320,8 +575,19 @@ class BoundedSet(frozenset):
             return self.saturation / intersect_size
         return 1
 
+    def contribution(self, intersect_size):
+        """
+        The score this set adds for a committee sharing `intersect_size`
+        candidates with it, i.e. phi(committee) * intersection_size(committee).
+        Computed on integers, as a saturated set always adds exactly `saturation`.
+
+        :param intersect_size: an integer
+        :return: an integer
+        """
+        return contribution(intersect_size, self.lower, self.saturation, self.upper)
+
     def serialize(self):
-        return {"set": list(self), "lower": self.lower, "saturation": self.saturation, "upper": self.upper}
+        return {"set": sorted(self, key=str), "lower": self.lower, "saturation": self.saturation, "upper": self.upper}
 
 
 #################################################################################
@@ -339,12 +605,15 @@ class ApprovalBallot(Ballot):
     def score(self, committee):
         app_candidates = self._decode()
         return len(app_candidates.intersection(committee))
+
+    def compile(self, profile):
+        return CompiledApprovalBallot(self._decode(), profile)
     
     def is_of_type(self, ballot_type):
         return ballot_type == "approvalBallot"  or ballot_type == "any"
 
     def _parse_from_json(self, json_content):
-        app_candidates = json_content["app_candidates"]
+        app_candidates = sorted(set(json_content["app_candidates"]), key=str)
         self.json_encoded = json.dumps({"app_candidates" : app_candidates})
     
     def get_involved_candidates(self):
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+
+def contribution(size, lower, saturation, upper):
+    """
+    The score a bounded set with the given bounds adds for a committee sharing
+    `size` candidates with it (see `BoundedSet.contribution`).
+
+    :return: an integer
+    """
+    if size < lower or size > upper:
+        return 0
+    return min(size, saturation)
+
+
+def contribution_table(mask, lower, saturation, upper, weight=1):
+    """
+    The contributions of a bounded set (see `contribution`) for all
+    intersection sizes 0, ..., |mask|, so that scoring it is a single lookup
+    after counting the intersection.
+
+    :param mask: the bitmask of the set
+    :param weight: a factor applied to all contributions, e.g. the number of ballots
+    :return: a tuple of integers
+    """
+    return tuple(weight * contribution(size, lower, saturation, upper) for size in range(mask.bit_count() + 1))
+
+
+class Profile(object):
+    """
+    The ballots of an election, decoded once into their compiled form.
+    Computing a winner scores many committees against the same ballots, so
+    the JSON columns are parsed here a single time per evaluation instead of
+    once per committee and ballot.
+
+    Every candidate is mapped to a bit position (its index in `candidates`).
+    Committees, approval sets and bounded sets are integer masks over these
+    bits, so an intersection size is a single `(a & b).bit_count()`.
+
+    Identical ballots are merged: `entries` is a list of pairs
+    (compiled ballot, number of ballots), and each distinct ballot is decoded
+    and scored once, weighted by its multiplicity. The profile can be built
+    from ballots or from running tallies (see `BallotPattern`).
+    """
+
+    def __init__(self, candidates, ballots=(), patterns=()):
+        self.candidates = list(candidates)
+        self.bits = {str(c.id): 1 << i for i, c in enumerate(self.candidates)}
+        self.ballot_count = 0
+        self._compiled = dict()
+        self._counts = dict()
+        for ballot in ballots:
+            self._add(ballot, 1)
+        for pattern in patterns:
+            if pattern.count:
+                self._add(pattern.to_ballot(), pattern.count)
+        self.entries = list(self._counts.items())
+
+    def _add(self, ballot, count):
+        key = (type(ballot), getattr(ballot, 'json_encoded', None) or id(ballot))
+        if key not in self._compiled:
+            self._compiled[key] = ballot.compile(self)
+        entry = self._compiled[key]
+        self._counts[entry] = self._counts.get(entry, 0) + count
+        self.ballot_count += count
+
+    def mask(self, candidate_ids):
+        """
+        Encode a set of candidate ids as bitmask. Unknown ids are ignored.
+
+        :param candidate_ids: an iterable of candidate ids
+        :return: an integer
+        """
+        mask = 0
+        for cid in candidate_ids:
+            mask |= self.bits.get(str(cid), 0)
+        return mask
+
+    def members(self, mask):
+        """
+        Decode a bitmask into the candidates it contains.
+
+        :param mask: an integer
+        :return: a tuple of candidates
+        """
+        return tuple(c for i, c in enumerate(self.candidates) if mask >> i & 1)
+
+    def score(self, committee):
+        """
+        Compute the total score of committee over all ballots.
+
+        :param committee: a committee bitmask
+        :return: a number
+        """
+        return sum(count * entry.score(committee) for entry, count in self.entries)
+
+    def rows(self):
+        """
+        Flatten the profile into weighted bounded sets. An approved set A is the
+        bounded set (A, 0, |A|, |A|), so both ballot types fit this form.
+
+        :return: a list of tuples (mask, weight, lower, saturation, upper), or
+                 None if some ballot has no compiled form.
+        """
+        rows = list()
+        for entry, count in self.entries:
+            if not hasattr(entry, 'rows'):
+                return None
+            for mask, lower, saturation, upper in entry.rows():
+                rows.append((mask, count, lower, saturation, upper))
+        return rows
+
+
+class CompiledBallot(object):
+    """
+    Fallback for ballot types without a compiled form: delegates to the ballot.
+    """
+    __slots__ = ('ballot', 'candidate_ids')
+
+    def __init__(self, ballot, profile):
+        self.ballot = ballot
+        self.candidate_ids = [str(c.id) for c in profile.candidates]
+
+    def score(self, committee):
+        return self.ballot.score({cid for i, cid in enumerate(self.candidate_ids) if committee >> i & 1})
+
+
+class CompiledApprovalBallot(object):
+    __slots__ = ('approved',)
+
+    def __init__(self, approved, profile):
+        self.approved = profile.mask(approved)
+
+    def score(self, committee):
+        return (self.approved & committee).bit_count()
+
+    def rows(self):
+        size = self.approved.bit_count()
+        return ((self.approved, 0, size, size),)
+
+    def __eq__(self, other):
+        return type(other) == type(self) and other.approved == self.approved
+
+    def __hash__(self):
+        return hash(self.approved)
+
+
+class CompiledBoundedApprovalBallot(object):
+    """
+    The bounded sets of a ballot as tuples (mask, lower, saturation, upper),
+    with a contribution table for each (see `contribution_table`).
+    """
+    __slots__ = ('sets', 'tables')
+
+    def __init__(self, bounded_sets, profile):
+        self.sets = tuple(sorted((profile.mask(bs), bs.lower, bs.saturation, bs.upper) for bs in bounded_sets))
+        self.tables = tuple((bounded_set[0], contribution_table(*bounded_set)) for bounded_set in self.sets)
+
+    def score(self, committee):
+        return sum(table[(mask & committee).bit_count()] for mask, table in self.tables)
+
+    def rows(self):
+        return self.sets
+
+    def _key(self):
+        return self.sets
+
+    def __eq__(self, other):
+        return type(other) == type(self) and other._key() == self._key()
+
+    def __hash__(self):
+        return hash(self._key())
@@ -1,9 +1,103 @@
+import cProfile
+import collections
+import datetime
+import functools
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import and_, or_, insert, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
 from ..auth.service import get_user
 from .models import *
+from . import engines, cost
+from .stats import EvaluationStats
+from .buffer import VoteBuffer
 from .. import db
+from ..metrics import registry
+from . import voting, logger
+
+
+class ResultCache(object):
+    """
+    In-process LRU tier of the winner-result cache. Entries are keyed by
+    (election id, vote count, evaluation mode) and hold results as returned by
+    `Election.get_result`. The persisted tier is the result stored with the
+    election itself (see `Election.has_current_result`).
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, election_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == election_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_result_cache = ResultCache()
+
+EVALUATION_DURATION = registry.histogram(
+    "goodvotex_evaluation_duration_seconds", "Time to recompute the winners of an election, by evaluation mode.",
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+COMMITTEES_SCORED = registry.counter("goodvotex_committees_scored_total", "Committees scored by evaluations.")
+BUFFERED_VOTES = registry.counter("goodvotex_buffered_votes_total",
+                                  "Votes from the write-behind buffer, by result (written or lost).")
+
+_vote_buffer_lock = threading.Lock()
+
+
+@registry.collector
+def _cache_metrics():
+    lookups = _result_cache.hits + _result_cache.misses
+    return [
+        ("goodvotex_result_cache_hits_total", "counter", "Winner results found in the in-process cache.",
+         _result_cache.hits),
+        ("goodvotex_result_cache_misses_total", "counter", "Winner results not found in the in-process cache.",
+         _result_cache.misses),
+        ("goodvotex_result_cache_hit_ratio", "gauge", "Hits per lookup of the in-process result cache so far.",
+         _result_cache.hits / lookups if lookups else 0.0),
+    ]
 
+# Seconds between two updates of the progress of a running job.
+PROGRESS_INTERVAL = 2
+# Attempts of a write when SQLite reports the database as locked, and the
+# seconds to wait at most before the second one (doubled for each further one).
+WRITE_ATTEMPTS = 5
+WRITE_BACKOFF = 0.05
 
-def register_election(ballot_type, title, description, candidates, K, user_owner):
+
+def register_election(ballot_type, title, description, candidates, K, user_owner, evaluation_mode="exact",
+                      expected_votes=None, tiebreak_seed=None):
     """
     Registers a new election.
 
@@ -12,9 +106,16 @@ def register_election(ballot_type, title, description, candidates, K, user_owner
     :param candidates:
     :param K:
     :param user_owner:
+    :param evaluation_mode: "exact" or "approximate" (see `engines.MODES`)
+    :param expected_votes: the expected number of votes, for `admit_election`
+    :param tiebreak_seed: seeds the random tie-break, to make results reproducible (None: unseeded)
     :return: When registration successful, returns the election object.
     """
-    e = Election(ballot_type=ballot_type, title=title, description=description, committeesize=K)
+    if evaluation_mode not in engines.MODES:
+        raise Exception("This evaluation mode is unknown.")
+    evaluation_mode = admit_election(ballot_type, len(candidates), K, expected_votes, evaluation_mode)
+    e = Election(ballot_type=ballot_type, title=title, description=description, committeesize=K,
+                 evaluation_mode=evaluation_mode, tiebreak_seed=tiebreak_seed)
     for c in candidates:
         e.candidates.append(Candidate(name=c))
     user_owner.elections.append(e)
@@ -24,6 +125,35 @@ def register_election(ballot_type, title, description, candidates, K, user_owner
     return e
 
 
+def admit_election(ballot_type, num_candidates, K, expected_votes=None, evaluation_mode="exact"):
+    """
+    Estimates how long evaluating an election will take (see `cost.CostModel`).
+    Exact evaluation above GOODVOTEX_EXACT_EVALUATION_LIMIT seconds is replaced
+    by approximate evaluation; elections above GOODVOTEX_EVALUATION_LIMIT
+    seconds are refused.
+
+    :param ballot_type:
+    :param num_candidates:
+    :param K:
+    :param expected_votes: the expected number of votes (None: GOODVOTEX_EXPECTED_VOTES)
+    :param evaluation_mode: the requested evaluation mode
+    :return: the evaluation mode to use
+    """
+    exact_limit = voting.config.get("GOODVOTEX_EXACT_EVALUATION_LIMIT", 0)
+    limit = voting.config.get("GOODVOTEX_EVALUATION_LIMIT", 0)
+    if not exact_limit and not limit:
+        return evaluation_mode
+    votes = expected_votes or voting.config.get("GOODVOTEX_EXPECTED_VOTES", 100)
+    workers = evaluation_options()["workers"] or os.cpu_count() or 1
+    model = cost.get_model()
+    if evaluation_mode == "exact" and exact_limit and \
+            model.estimate_election(ballot_type, num_candidates, K, votes, "exact", workers) > exact_limit:
+        evaluation_mode = "approximate"
+    if limit and model.estimate_election(ballot_type, num_candidates, K, votes, evaluation_mode, workers) > limit:
+        raise Exception("Evaluating this election would take too long. Use fewer candidates or a smaller committee.")
+    return evaluation_mode
+
+
 def get_election(election_id):
     """
 
@@ -59,26 +189,203 @@ def search(search_string):
 
 def add_vote_from_json(election_id, json_content):
     """
-    Adds a ballot to the given election.
+    Adds a ballot to the given election. The election itself is not loaded:
+    the ballot is checked against its cached candidates (see
+    `_ballot_rules`), only the new ballot is inserted, and the database
+    increases the vote count and the running tally. So every vote costs the
+    same, however many votes the election already has.
 
     :param election_id:
-    :param ballot:
+    :param json_content:
     :return:
     """
-    e = get_election(election_id)
+    election_id = _election_id(election_id)
+    ballot = _ballot_from_json(json_content)
+    ballot_type, candidate_ids = _ballot_rules(election_id)
+    Election.check_ballot(ballot, ballot_type, candidate_ids)
+    if voting.config.get("GOODVOTEX_WRITE_BEHIND", False):
+        if db.session.query(Election.is_stopped).filter_by(id=election_id).scalar():
+            raise Exception("The creator stopped the voting process. You can no longer vote.")
+        _get_vote_buffer().put((election_id, type(ballot), ballot.json_encoded))
+        return
+    _retry_if_busy(_insert_ballots, election_id, [(type(ballot), ballot.json_encoded, 1)])
+    _result_cache.invalidate(election_id)
+
+
+def add_votes_from_json(election_id, json_contents, counts=None):
+    """
+    Adds many ballots to the given election in one transaction, e.g. when
+    importing them. Each ballot is checked like in `add_vote_from_json`;
+    invalid ones are skipped, the others are inserted with one statement
+    per ballot type (executemany).
+
+    :param election_id:
+    :param json_contents: a list of ballots as for `add_vote_from_json`
+    :param counts: how often each ballot was cast (None: once each)
+    :return: a list with None for each added ballot and the reason for each skipped one
+    """
+    election_id = _election_id(election_id)
+    ballot_type, candidate_ids = _ballot_rules(election_id)
+    errors, ballots = list(), list()
+    for i, json_content in enumerate(json_contents):
+        try:
+            ballot = _ballot_from_json(json_content)
+            Election.check_ballot(ballot, ballot_type, candidate_ids)
+        except Exception as ex:
+            errors.append(str(ex))
+            continue
+        ballots.append((type(ballot), ballot.json_encoded, counts[i] if counts is not None else 1))
+        errors.append(None)
+    if ballots:
+        _retry_if_busy(_insert_ballots, election_id, ballots)
+        _result_cache.invalidate(election_id)
+    return errors
+
+
+def _election_id(election_id):
+    try:
+        return int(election_id)
+    except ValueError:
+        raise Exception("This election does not exist.")
+
+
+def _ballot_from_json(json_content):
     constructors = {
         "boundedApprovalBallot" : BoundedApprovalBallot,
         "approvalBallot" : ApprovalBallot
     }
     if json_content["type"] in constructors:
-        ballot = constructors[json_content["type"]](json_content)
-    else:
-        raise Exception("This ballot type is unknown.")
-    e.add_ballot(ballot)
-    db.session.add(e)
+        return constructors[json_content["type"]](json_content)
+    raise Exception("This ballot type is unknown.")
+
+
+def _insert_ballots(election_id, ballots):
+    # ballots: a list of (ballot class, json_encoded, count). The database
+    # increases the vote count, so concurrent votes cannot lose an increment.
+    counted = db.session.execute(
+        update(Election)
+        .where(Election.id == election_id, Election.is_stopped.isnot(True))
+        .values(votecount=Election.votecount + sum(count for constructor, json_encoded, count in ballots))
+    )
+    if counted.rowcount == 0:
+        db.session.rollback()
+        raise Exception("The creator stopped the voting process. You can no longer vote.")
+    rows = collections.defaultdict(list)
+    patterns = collections.Counter()
+    for constructor, json_encoded, count in ballots:
+        rows[constructor] += [{"election_id": election_id, "json_encoded": json_encoded}] * count
+        patterns[(constructor.__mapper_args__["polymorphic_identity"], json_encoded)] += count
+    for constructor, values in rows.items():
+        db.session.execute(insert(constructor), values)
+    for (ballot_type, json_encoded), count in patterns.items():
+        count_pattern(db.session, election_id, ballot_type, json_encoded, count)
     db.session.commit()
 
 
+def _insert_votes(votes):
+    # Like _insert_vote, for a batch of (election id, constructor, json_encoded).
+    # The votes were accepted before, so they count even if the election was stopped meanwhile.
+    votecounts = collections.Counter(election_id for election_id, constructor, json_encoded in votes)
+    existing = {election_id for (election_id,) in
+                db.session.query(Election.id).filter(Election.id.in_(list(votecounts)))}
+    votes = [vote for vote in votes if vote[0] in existing]  # the election may have been deleted
+    for election_id in existing:
+        db.session.execute(update(Election).where(Election.id == election_id)
+                           .values(votecount=Election.votecount + votecounts[election_id]))
+    db.session.add_all([constructor(json_encoded=json_encoded, election_id=election_id)
+                        for election_id, constructor, json_encoded in votes])
+    patterns = collections.Counter((election_id, constructor.__mapper_args__["polymorphic_identity"], json_encoded)
+                                   for election_id, constructor, json_encoded in votes)
+    for (election_id, ballot_type, json_encoded), count in patterns.items():
+        count_pattern(db.session, election_id, ballot_type, json_encoded, count)
+    db.session.commit()
+
+
+def _write_buffered_votes(votes):
+    """
+    Writes a batch of buffered votes (see `buffer.VoteBuffer`) in one
+    transaction. If that fails, the votes are written one by one, so that
+    one bad vote does not lose the others.
+
+    :param votes: a list of (election id, ballot class, json_encoded)
+    :return:
+    """
+    try:
+        _retry_if_busy(_insert_votes, votes)
+        BUFFERED_VOTES.inc(len(votes), result="written")
+    except Exception as ex:
+        db.session.rollback()
+        logger.error("Writing a batch of %d votes failed, writing them one by one: %s" % (len(votes), ex))
+        for vote in votes:
+            try:
+                _retry_if_busy(_insert_votes, [vote])
+                BUFFERED_VOTES.inc(result="written")
+            except Exception as ex:
+                db.session.rollback()
+                BUFFERED_VOTES.inc(result="lost")
+                logger.error("Lost a vote for election %d: %s" % (vote[0], ex))
+    for election_id in {vote[0] for vote in votes}:
+        _result_cache.invalidate(election_id)
+
+
+def _get_vote_buffer():
+    app = current_app._get_current_object()
+    with _vote_buffer_lock:
+        if "goodvotex_vote_buffer" not in app.extensions:
+            app.extensions["goodvotex_vote_buffer"] = VoteBuffer(
+                app, _write_buffered_votes,
+                maxsize=voting.config.get("GOODVOTEX_WRITE_BEHIND_QUEUE", 10000),
+                batch_size=voting.config.get("GOODVOTEX_WRITE_BEHIND_BATCH", 500),
+                interval=voting.config.get("GOODVOTEX_WRITE_BEHIND_INTERVAL", 0.5))
+        return app.extensions["goodvotex_vote_buffer"]
+
+
+def flush_votes():
+    """
+    Writes the votes waiting in the write-behind buffer (see GOODVOTEX_WRITE_BEHIND) now.
+
+    :return:
+    """
+    buffer = current_app.extensions.get("goodvotex_vote_buffer")
+    if buffer is not None:
+        buffer.flush()
+
+
+def _retry_if_busy(function, *args):
+    """
+    Runs a transaction, and runs it again if SQLite reports the database as
+    locked by another writer. Each attempt starts from a rolled back session.
+
+    :param function: runs and commits the transaction
+    :param args: passed on to function
+    :return: what function returns
+    """
+    for attempt in range(WRITE_ATTEMPTS):
+        try:
+            return function(*args)
+        except OperationalError as ex:
+            db.session.rollback()
+            if "locked" not in str(ex.orig) or attempt == WRITE_ATTEMPTS - 1:
+                raise
+            # Back off randomly, so that waiting writers do not collide again.
+            time.sleep(random.uniform(0, WRITE_BACKOFF * 2 ** attempt))
+
+
+@functools.lru_cache(maxsize=1024)
+def _ballot_rules(election_id):
+    """
+    The ballots an election accepts. Cached, as the ballot type and the
+    candidates of an election never change after its registration.
+
+    :param election_id: an int
+    :return: a tuple (ballot type, frozenset of the candidate ids as strings)
+    """
+    e = get_election(election_id)
+    if e is None:
+        raise Exception("This election does not exist.")
+    return e.ballot_type, frozenset(str(c.id) for c in e.candidates)
+
+
 def delete_election(election_id, user):
     """
     Deletes the given election. This will also delete it from the persistent storage!
@@ -90,26 +397,249 @@ def delete_election(election_id, user):
     e = get_election(election_id)
     if not user.owns_election(e):
         raise Exception("You need to login!")
+    _result_cache.invalidate(e.id)
     Election.query.filter_by(id=election_id).delete()
     db.session.commit()
+    _ballot_rules.cache_clear()  # the id may be given to a new election
 
 
-def evaluate(election_id, user):
+def evaluate(election_id, user, time_budget=None, committee_budget=None):
     """
-    Evaluates an election, i.e. computes the current winners.
+    Evaluates an election, i.e. computes the current winners. Results are
+    cached, so this only recomputes if votes were added since the last time.
+    If a budget runs out, the best committee found so far is stored as
+    provisional result and the next evaluation continues the search (see
+    `Election.recompute_current_winner`).
 
     :param election_id:
     :param user:
+    :param time_budget: seconds the search may take (None: the server's setting)
+    :param committee_budget: number of committees the search may score (None: the server's setting)
     :return:
     """
     e = get_election(election_id)
     if not user.owns_election(e):
         raise Exception("You need to login!")
-    e.recompute_current_winner()
+    budgets = {"time_budget": time_budget, "committee_budget": committee_budget}
+    options = {key: value for key, value in budgets.items() if value is not None}
+    # Worker processes are only started by the background worker, not in web requests.
+    _evaluate(e, workers=1, **options)
     db.session.add(e)
     db.session.commit()
 
 
+def _evaluate(e, stats=None, **options):
+    """
+    Sets the current result of an election, from the cache or by recomputing
+    it. Recomputations are logged with their EvaluationStats, and profiled
+    into GOODVOTEX_PROFILE_DIR if that is set.
+
+    :param e: an election
+    :param stats: an EvaluationStats to record into (optional)
+    :param options: overrides of `evaluation_options`, and `progress` (see `engines.choose_engine`)
+    :return:
+    """
+    key = (e.id, e.votecount, e.evaluation_mode or "exact")
+    _result_cache.maxsize = voting.config.get("GOODVOTEX_RESULT_CACHE_SIZE", _result_cache.maxsize)
+    cached = _result_cache.get(key)
+    if cached is not None:
+        e.set_result(*cached)
+    elif e.has_current_result():
+        _result_cache.put(key, e.get_result())
+    else:
+        options = dict(evaluation_options(), **options)
+        mode = _choose_mode(e, options)
+        stats = stats or EvaluationStats()
+        profile_dir = voting.config.get("GOODVOTEX_PROFILE_DIR", "")
+        profiler = cProfile.Profile() if profile_dir else None
+        if profiler is not None:
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            e.recompute_current_winner(mode=mode, cost_model=cost.get_model(), stats=stats, **options)
+        finally:
+            EVALUATION_DURATION.observe(time.perf_counter() - started, mode=mode)
+            COMMITTEES_SCORED.inc(stats.counters.get("committees_scored", 0))
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(profile_dir, "election-%d-%d-%s.prof" % (
+                    e.id, e.votecount, datetime.datetime.now().strftime("%Y%m%d%H%M%S%f"))))
+        logger.info("Evaluated election %d (%d votes, %s%s): %s" % (
+            e.id, e.votecount, mode, ", provisional" if e.result_provisional else "", stats))
+        if e.has_current_result():  # provisional results are not cached
+            _result_cache.put(key, e.get_result())
+
+
+def _choose_mode(e, options):
+    # Elections may get many more votes than expected at their creation. Without
+    # a budget to stop the search, evaluate them approximately; only this result
+    # is approximate, the election keeps its evaluation mode.
+    mode = e.evaluation_mode or "exact"
+    limit = voting.config.get("GOODVOTEX_EXACT_EVALUATION_LIMIT", 0)
+    if mode != "exact" or not limit or options.get("time_budget") \
+            or options.get("committee_budget") or e.ballot_type == "approvalBallot":
+        return mode
+    workers = options.get("workers") or os.cpu_count() or 1
+    rows = len(e.patterns) * cost.SETS_PER_BALLOT
+    seconds = cost.get_model().fastest_exact(len(e.candidates), e.committeesize, rows, workers)[1]
+    if seconds > limit:
+        logger.info("Election %d is evaluated approximately, exact evaluation would take %.0f seconds." % (e.id, seconds))
+        return "approximate"
+    return mode
+
+
+def request_evaluation(election_id, user):
+    """
+    Asks the worker to evaluate an election in the background. Requests for
+    an election and vote count which already has a job return that job.
+
+    :param election_id:
+    :param user:
+    :return: the EvaluationJob, or None if the stored result is current anyway.
+    """
+    e = get_election(election_id)
+    if not user.owns_election(e):
+        raise Exception("You need to login!")
+    job = _find_evaluation_job(e.id, e.votecount)
+    if job is None and e.has_current_result():
+        return get_latest_evaluation_job(e.id)
+    if job is None:
+        election_id, votecount = e.id, e.votecount
+        db.session.add(EvaluationJob(election_id=election_id, votecount=votecount))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # a concurrent request created the job first
+        return _find_evaluation_job(election_id, votecount)
+    if job.status == "failed":
+        job.status = "pending"
+        db.session.commit()
+    return job
+
+
+def _find_evaluation_job(election_id, votecount):
+    return EvaluationJob.query.filter_by(election_id=election_id, votecount=votecount).first()
+
+
+def get_latest_evaluation_job(election_id):
+    """
+
+    :param election_id:
+    :return: The most recently requested EvaluationJob of the election (if exists).
+    """
+    return EvaluationJob.query.filter_by(election_id=election_id).order_by(EvaluationJob.id.desc()).first()
+
+
+def get_evaluation_progress(election_id, user):
+    """
+
+    :param election_id:
+    :param user:
+    :return: The most recently requested EvaluationJob of the election (if exists), for its progress.
+    """
+    e = get_election(election_id)
+    if not user.owns_election(e):
+        raise Exception("You need to login!")
+    return get_latest_evaluation_job(e.id)
+
+
+def claim_evaluation_job():
+    """
+    Takes the oldest pending job and marks it as running. Several workers may
+    call this concurrently; every job is handed out once. Jobs running for
+    longer than GOODVOTEX_JOB_TIMEOUT seconds are taken as well, as their
+    worker probably crashed.
+
+    :return: an EvaluationJob, or None if there is no pending job.
+    """
+    timeout = datetime.timedelta(seconds=voting.config.get("GOODVOTEX_JOB_TIMEOUT", 3600))
+    claimable = or_(EvaluationJob.status == "pending",
+                    and_(EvaluationJob.status == "running",
+                         EvaluationJob.started_at < datetime.datetime.now() - timeout))
+    for job in EvaluationJob.query.filter(claimable).order_by(EvaluationJob.id).limit(10):
+        claimed = db.session.execute(
+            update(EvaluationJob)
+            .where(EvaluationJob.id == job.id, claimable)
+            .values(status="running", started_at=datetime.datetime.now(), progress=0)
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            db.session.refresh(job)
+            return job
+    return None
+
+
+def run_evaluation_job(job):
+    """
+    Evaluates the election of a claimed job and records the outcome.
+
+    :param job: an EvaluationJob
+    :return:
+    """
+    job_id = job.id
+    reported = [time.monotonic()]
+
+    def report(progress):
+        # Called by the engine; stores the progress every PROGRESS_INTERVAL seconds.
+        if time.monotonic() - reported[0] >= PROGRESS_INTERVAL:
+            reported[0] = time.monotonic()
+            db.session.execute(update(EvaluationJob).where(EvaluationJob.id == job_id).values(progress=progress))
+            db.session.commit()
+
+    try:
+        e = get_election(job.election_id)
+        stats = EvaluationStats()
+        # The worker has no latency limit.
+        _evaluate(e, stats, time_budget=None, committee_budget=None, progress=report)
+        job.progress = 1.0
+        job.stats = json.dumps(stats.to_dict())
+        job.status = "done"
+    except Exception as ex:
+        db.session.rollback()
+        job.status = "failed"
+        job.error = str(ex)[:500]
+    job.finished_at = datetime.datetime.now()
+    db.session.add(job)
+    db.session.commit()
+
+
+def evaluates_in_background():
+    """
+    :return: True if winners are computed by the worker instead of the web server.
+    """
+    return voting.config.get("GOODVOTEX_BACKGROUND_EVALUATION", False)
+
+
+def recount(election_id):
+    """
+    Recounts all ballots of an election and repairs its running tallies if
+    necessary. This reads every ballot of the election.
+
+    :param election_id:
+    :return: True if the tallies were correct.
+    """
+    e = get_election(election_id)
+    correct = e.recount()
+    if not correct:
+        db.session.add(e)
+        db.session.commit()
+    return correct
+
+
+def evaluation_options():
+    """
+    The server-wide settings for winner computation (see `engines.choose_engine`).
+
+    :return: a dict
+    """
+    return {
+        "workers": voting.config.get("GOODVOTEX_EVALUATION_WORKERS", 1),
+        "engine": voting.config.get("GOODVOTEX_EVALUATION_ENGINE", "auto"),
+        "time_budget": voting.config.get("GOODVOTEX_EVALUATION_TIME_BUDGET", 0),
+        "committee_budget": voting.config.get("GOODVOTEX_EVALUATION_COMMITTEE_BUDGET", 0),
+    }
+
+
 def stop_election(election_id, user):
     """
     Stops an election.
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import time
+from contextlib import contextmanager
+
+
+class EvaluationStats(object):
+    """
+    Timings and counters of an evaluation, to find out which elections are
+    expensive and why. The phases of `Election.recompute_current_winner` are
+
+    - load: reading the running tallies (or recounting the ballots),
+    - decode: parsing the ballots into a `Profile`,
+    - search: enumerating and scoring committees in the engine,
+    - tie-break: choosing the winner among the best committees.
+    """
+
+    PHASES = ["load", "decode", "search", "tie-break"]
+
+    def __init__(self):
+        self.timings = dict()
+        self.counters = dict()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - started
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def peak(self, name, value):
+        self.counters[name] = max(self.counters.get(name, 0), value)
+
+    def total(self):
+        """
+        :return: the seconds spent in all phases
+        """
+        return sum(self.timings.values())
+
+    def to_dict(self):
+        """
+        :return: a dict with the keys "timings" (seconds per phase) and "counters"
+        """
+        return {"timings": dict(self.timings), "counters": dict(self.counters)}
+
+    def __str__(self):
+        timings = " ".join("%s=%.3fs" % (name, self.timings[name]) for name in self.PHASES if name in self.timings)
+        counters = " ".join("%s=%d" % item for item in sorted(self.counters.items()))
+        return "%s %s" % (timings, counters)
@@ -1,8 +1,14 @@
-from flask import render_template, request, flash, url_for, redirect
+import json
+
+from flask import render_template, request, flash, url_for, redirect, jsonify
 from flask_login import login_required, current_user
 from werkzeug.exceptions import HTTPException
 
 from . import service, voting, logger
+from .buffer import BufferFull
+from ..metrics import registry
+
+VOTES = registry.counter("goodvotex_votes_total", "Ballots submitted, by result (accepted or rejected).")
 
 
 @voting.route('/', methods=['GET'])
@@ -22,17 +28,29 @@ def create_election_page():
             flash("Candidate set must be larger than committee-size.", "error")
         else:
             # we can continue creation with the given candidate set.
-            election = service.register_election(
-                ballot_type,
-                request.form.get('name'),
-                request.form.get('description'),
-                candidates,
-                int(request.form.get('committeesize')),
-                current_user
-            )
+            evaluation_mode = request.form.get('evaluation_mode', 'exact')
+            expected_votes = request.form.get('expected_votes', '')
+            tiebreak_seed = request.form.get('tiebreak_seed', '')
+            try:
+                election = service.register_election(
+                    ballot_type,
+                    request.form.get('name'),
+                    request.form.get('description'),
+                    candidates,
+                    int(request.form.get('committeesize')),
+                    current_user,
+                    evaluation_mode,
+                    int(expected_votes) if expected_votes.isdigit() else None,
+                    int(tiebreak_seed) if tiebreak_seed.isdigit() else None
+                )
+            except Exception as e:
+                flash(str(e) + " Creation failed.", "error")
+                return render_template('create.html', elections=service.get_all_elections())
             logger.info("Election registered: %s, %d candidates, committee size: %d" % (
                 election.title, len(election.candidates), election.committeesize))
             flash("Election was successfully created.", "info")
+            if election.evaluation_mode != evaluation_mode:
+                flash("Exact evaluation would take too long for this election, so it will be evaluated approximately.", "info")
             return redirect(url_for('voting.details_page', electionID=election.id))
 
     return render_template('create.html', elections=service.get_all_elections())
@@ -55,11 +73,27 @@ def search_election():
 def details_page(electionID):
     election = service.get_election(electionID)
     if current_user.is_authenticated and current_user.owns_election(election):
+        if service.evaluates_in_background():
+            job = service.request_evaluation(electionID, current_user)
+            return render_template('details.html', election=election, admin=True, job=job)
         service.evaluate(electionID, current_user)
         return render_template('details.html', election=election, admin=True)
     return render_template('details.html', election=election, admin=False)
 
 
+@voting.route('/details/<electionID>/progress')
+@login_required
+def progress(electionID):
+    try:
+        job = service.get_evaluation_progress(electionID, current_user)
+    except Exception as e:
+        return str(e), 403
+    if job is None:
+        return jsonify(status="none", progress=0)
+    return jsonify(status=job.status, progress=job.progress or 0, votecount=job.votecount,
+                   stats=json.loads(job.stats) if job.stats else None)
+
+
 @voting.route('/vote/<electionID>')
 def voting_page(electionID):
     election=service.get_election(electionID)
@@ -71,17 +105,49 @@ def add_vote(electionID):
     try:
         json_content = request.get_json()
         service.add_vote_from_json(electionID, json_content)
+    except BufferFull as e:
+        VOTES.inc(result="rejected")
+        return str(e), 503, {"Retry-After": "5"}
     except Exception as e:
+        VOTES.inc(result="rejected")
         return "Something is wrong with the data: " + str(e), 400
+    VOTES.inc(result="accepted")
     return "OK"
 
 
+@voting.route('/vote/<electionID>/batch', methods=['POST'])
+def add_votes(electionID):
+    # A JSON array of ballots as posted to /vote/<electionID>, e.g. from kiosks
+    # replaying the ballots they collected. The valid ones are stored in one
+    # transaction; the answer tells for each ballot whether it was accepted.
+    json_contents = request.get_json(silent=True)
+    if not isinstance(json_contents, list):
+        return "Something is wrong with the data: Expected a JSON array of ballots.", 400
+    if len(json_contents) > voting.config.get("GOODVOTEX_MAX_BATCH_VOTES", 1000):
+        return "Something is wrong with the data: At most %d ballots can be sent at once." % \
+            voting.config.get("GOODVOTEX_MAX_BATCH_VOTES", 1000), 413
+    try:
+        errors = service.add_votes_from_json(electionID, json_contents)
+    except Exception as e:
+        VOTES.inc(len(json_contents), result="rejected")
+        return "Something is wrong with the data: " + str(e), 400
+    results = [{"accepted": True} if error is None else {"accepted": False, "error": error} for error in errors]
+    accepted = errors.count(None)
+    VOTES.inc(accepted, result="accepted")
+    VOTES.inc(len(errors) - accepted, result="rejected")
+    return jsonify(accepted=accepted, rejected=len(errors) - accepted, results=results)
+
+
 @voting.route('/evaluate/<electionID>', methods=['POST'])
 @login_required
 def evaluate(electionID):
     election = service.get_election(electionID)
-    best_committee = service.evaluate(electionID, current_user)
-    service.stop_election(electionID, current_user)
+    if service.evaluates_in_background():
+        service.stop_election(electionID, current_user)
+        service.request_evaluation(electionID, current_user)
+    else:
+        best_committee = service.evaluate(electionID, current_user)
+        service.stop_election(electionID, current_user)
     logger.info("Election stopped by creator: %s (%s)" % (electionID, election.title))
     return render_template('done.html', forward="/details/" + electionID)
 
@@ -9,3 +9,12 @@ import os
 
 from .test_voting_models import *
 from .test_voting_service import *
+from .test_voting_profile import *
+from .test_voting_engines import *
+from .test_voting_jobs import *
+from .test_voting_cost import *
+from .test_benchmarks import *
+from .test_metrics import *
+from .test_voting_buffer import *
+from .test_voting_import import *
+from .test_voting_views import *
@@ -0,0 +1,21 @@
+from .context import goodvotex
+from goodvotex.voting import service
+
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    An application with an empty database in a temporary directory.
+    """
+    monkeypatch.setenv("FLASK_DB_RELATIVE_PATH", str(tmp_path / "database.db"))
+    monkeypatch.setenv("FLASK_SECRET_KEY", "test")
+    app = goodvotex.create_app()
+    with app.app_context():
+        goodvotex.db.create_all()
+    service._result_cache.clear()
+    service._ballot_rules.cache_clear()
+    with patch.object(service, 'db', goodvotex.db):
+        yield app
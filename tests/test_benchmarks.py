@@ -0,0 +1,32 @@
+from .context import goodvotex
+from benchmarks import generators, run
+from goodvotex.voting.models import *
+
+import json
+import pytest
+
+
+
+"""
+    Tests for the benchmark suite
+"""
+
+def test_generators_are_seeded_and_valid():
+    for ballot_type, constructor in run.CONSTRUCTORS.items():
+        for structure in generators.STRUCTURES:
+            ballots = generators.generate_ballots(1, ballot_type, range(10), 50, structure)
+            assert ballots == generators.generate_ballots(1, ballot_type, range(10), 50, structure)
+            for ballot in ballots:
+                parsed = constructor(ballot)
+                assert parsed.get_involved_candidates() <= {str(c) for c in range(10)}
+    with pytest.raises(Exception):
+        generators.generate_ballots(1, "approvalBallot", range(10), 5, "magic")
+
+def test_benchmarks_check_engines(app):
+    results = run.run(app, run.QUICK_SCENARIOS, structures=["clustered"], search_elections=3)
+    results = json.loads(json.dumps(results))
+    assert len(results["scenarios"]) == 2
+    for scenario in results["scenarios"]:
+        assert scenario["compute_winner"]["stats"]["counters"]["ballots"] == scenario["ballots"]
+        assert all(check["agrees"] for check in scenario["engines"].values())
+    assert run.compare(results, results)[1].endswith("compute_winner=1.00")
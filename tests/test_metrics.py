@@ -0,0 +1,77 @@
+from .context import goodvotex
+from goodvotex.metrics import registry as app_registry
+from goodvotex.metrics.registry import Registry
+from goodvotex.voting import service
+from goodvotex.auth.models import User
+
+import threading
+
+
+
+"""
+    Tests for metrics
+"""
+
+def test_counters_are_summed_over_threads():
+    registry = Registry()
+    counter = registry.counter("things_total", "Things.")
+    assert registry.counter("things_total", "Things.") is counter
+
+    def count():
+        for _ in range(1000):
+            counter.inc(kind="a")
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    counter.inc(5, kind="b")
+    assert 'things_total{kind="b"} 5' in registry.render()
+    for thread in threads:
+        thread.join()
+    # Shards of finished threads are folded into the totals.
+    assert 'things_total{kind="a"} 4000' in registry.render()
+    assert 'things_total{kind="a"} 4000' in registry.render()
+
+def test_histogram_rendering():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value, route='/a"b')
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"]
+    assert 'latency_seconds_bucket{route="/a\\"b",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a\\"b",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/a\\"b"} 2.65' in lines
+    assert 'latency_seconds_count{route="/a\\"b"} 4' in lines
+
+def test_metrics_endpoint(app):
+    app_registry.clear()
+    client = app.test_client()
+    with app.app_context():
+        owner = User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+        e = service.register_election('approvalBallot', 'Foo', 'Bar', ['a', 'b', 'c'], 2, owner)
+        candidate = str(e.candidates[0].id)
+        election_id = e.id
+    assert client.post("/vote/%d" % election_id, json={'type': 'approvalBallot', 'app_candidates': [candidate]}).status_code == 200
+    assert client.post("/vote/%d" % election_id, json={'type': 'approvalBallot', 'app_candidates': ['x']}).status_code == 400
+    with app.app_context():
+        service.evaluate(election_id, User.query.filter_by(username="owner").first())
+        service.evaluate(election_id, User.query.filter_by(username="owner").first())
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.content_type.startswith("text/plain")
+    text = response.get_data(as_text=True)
+    assert 'goodvotex_votes_total{result="accepted"} 1' in text
+    assert 'goodvotex_votes_total{result="rejected"} 1' in text
+    assert 'goodvotex_http_requests_total{method="POST",route="/vote/<electionID>",status="200"} 1' in text
+    assert 'goodvotex_http_request_duration_seconds_count{route="/vote/<electionID>"} 2' in text
+    assert 'goodvotex_http_request_db_queries_bucket{route="/vote/<electionID>",le="+Inf"} 2' in text
+    assert 'goodvotex_evaluation_duration_seconds_count{mode="exact"} 1' in text
+    assert service._result_cache.hits > 0
+    assert "goodvotex_result_cache_hits_total %d" % service._result_cache.hits in text
+    queries = [line for line in text.splitlines() if line.startswith("goodvotex_db_queries_total ")]
+    assert queries and int(queries[0].split()[1]) > 0
+
+def test_metrics_can_be_disabled(app, monkeypatch):
+    from goodvotex.metrics import metrics
+    monkeypatch.setitem(metrics.config, "GOODVOTEX_ENABLE_METRICS", False)
+    assert app.test_client().get("/metrics").status_code == 404
@@ -0,0 +1,93 @@
+from .context import goodvotex
+from goodvotex.voting import service, voting
+from goodvotex.voting.buffer import VoteBuffer, BufferFull
+from goodvotex.auth.models import User
+
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+"""
+    Tests for the write-behind buffer
+"""
+
+def test_buffer_writes_batches_and_flushes_on_close(app):
+    written = list()
+    buffer = VoteBuffer(app, written.append, batch_size=2, interval=10)
+    for vote in range(5):
+        buffer.put(vote)
+    deadline = time.monotonic() + 5
+    while len(written) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert written[:2] == [[0, 1], [2, 3]]  # size trigger
+    buffer.close()
+    assert written == [[0, 1], [2, 3], [4]]
+    with pytest.raises(BufferFull):
+        buffer.put(5)
+
+def test_buffer_writes_after_interval(app):
+    written = list()
+    buffer = VoteBuffer(app, written.append, batch_size=100, interval=0.05)
+    buffer.put(1)
+    deadline = time.monotonic() + 5
+    while not written and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert written == [[1]]  # time trigger
+    buffer.close()
+
+def test_full_buffer_rejects_votes(app):
+    written, release = list(), threading.Event()
+    buffer = VoteBuffer(app, lambda batch: (release.wait(), written.append(batch)),
+                        maxsize=1, batch_size=1, timeout=0.1)
+    buffer.put(1)
+    deadline = time.monotonic() + 5
+    while buffer.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    buffer.put(2)  # the writer is busy with 1
+    with pytest.raises(BufferFull):
+        buffer.put(3)
+    release.set()
+    buffer.close()
+    assert written == [[1], [2]]
+
+def test_buffered_votes_are_counted(app, monkeypatch):
+    monkeypatch.setitem(voting.config, "GOODVOTEX_WRITE_BEHIND", True)
+    monkeypatch.setitem(voting.config, "GOODVOTEX_WRITE_BEHIND_INTERVAL", 0.05)
+    monkeypatch.setitem(voting.config, "GOODVOTEX_WRITE_BEHIND_BATCH", 50)
+    with app.app_context():
+        owner = User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+        e = service.register_election('approvalBallot', 'Foo', 'Bar', ['a', 'b', 'c'], 2, owner)
+        election_id, ids = e.id, [str(c.id) for c in e.candidates]
+        assert service.get_election(election_id).votecount == 0
+    votes = [{'type': 'approvalBallot', 'app_candidates': ids[i % 3:i % 3 + 2]} for i in range(400)]
+
+    def vote(chunk):
+        client = app.test_client()
+        return [client.post("/vote/%d" % election_id, json=v).status_code for v in chunk]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = [status for chunk in pool.map(vote, [votes[i::8] for i in range(8)]) for status in chunk]
+    assert statuses == [200] * len(votes)
+    assert app.test_client().post("/vote/%d" % election_id, json={'type': 'approvalBallot',
+                                                                  'app_candidates': ['x']}).status_code == 400
+    with app.app_context():
+        app.extensions["goodvotex_vote_buffer"].close()
+        e = service.get_election(election_id)
+        assert e.votecount == len(votes) == len(e.ballots) == sum(p.count for p in e.patterns)
+
+        e.stop()
+        goodvotex.db.session.commit()
+        with pytest.raises(Exception):
+            service.add_vote_from_json(election_id, votes[0])
+
+def test_buffered_votes_survive_bad_votes(app):
+    with app.app_context():
+        owner = User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+        e = service.register_election('approvalBallot', 'Foo', 'Bar', ['a', 'b', 'c'], 2, owner)
+        election_id = e.id
+        good = (election_id, goodvotex.voting.models.ApprovalBallot, '{"app_candidates": []}')
+        bad = (election_id, goodvotex.voting.models.ApprovalBallot, None)  # json_encoded must not be null
+        service._write_buffered_votes([good, bad, good])
+        assert service.get_election(election_id).votecount == 2
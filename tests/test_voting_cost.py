@@ -0,0 +1,54 @@
+from .context import goodvotex
+from goodvotex.voting import cost, engines, service, voting
+from goodvotex.voting.profile import Profile
+from .test_voting_engines import make_random_bounded_profile
+
+import pytest
+
+
+
+"""
+    Tests for the evaluation cost model
+"""
+
+def test_estimates_grow_with_committees_and_votes():
+    model = cost.CostModel()
+    for engine in ["exhaustive", "vectorized", "approximate"]:
+        assert model.estimate(engine, 20, 5, 100) < model.estimate(engine, 30, 5, 100)
+        assert model.estimate(engine, 20, 5, 100) < model.estimate(engine, 20, 5, 1000)
+    assert model.estimate_election("approvalBallot", 40, 10, 1000) < 1
+    # The estimate for bounded approval ballots is probed, so only compare orders of magnitude.
+    assert model.estimate_election("boundedApprovalBallot", 40, 10, 1000) > 60
+
+def test_calibrated_model_picks_exact_engine():
+    model = cost.CostModel.calibrate(num_candidates=8, committeesize=3, num_rows=10)
+    assert set(model.unit_costs) >= {"exhaustive", "parallel"}
+    name, seconds = model.fastest_exact(30, 8, 1000, workers=4)
+    assert name in ["branch-and-bound", "parallel"] and seconds > 0
+
+def test_branch_and_bound_estimate_accounts_for_pruning():
+    model = cost.CostModel()
+    assert model.estimate("branch-and-bound", 8, 3, 10) < cost.PROBE_SECONDS
+    # Scoring all committees would take hours.
+    assert model.estimate("branch-and-bound", 40, 8, 200) < model.estimate("exhaustive", 40, 8, 200) / 10
+    # Larger profiles are probed with PROBE_ROWS rows.
+    assert model.estimate("branch-and-bound", 40, 8, 8 * cost.PROBE_ROWS) == \
+        pytest.approx(8 * model.estimate("branch-and-bound", 40, 8, cost.PROBE_ROWS))
+
+def test_choose_engine_with_cost_model():
+    profile = make_random_bounded_profile(0, 8, 5)
+    model = cost.CostModel({"vectorized": 1.0, "parallel": 1.0})
+    assert engines.choose_engine(profile, committeesize=3, cost_model=model) == engines.branch_and_bound
+
+def test_admission_control_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(voting, "config", dict())
+    assert service.admit_election("boundedApprovalBallot", 300, 100, 100000) == "exact"
+
+def test_admission_control(monkeypatch):
+    monkeypatch.setattr(voting, "config", {"GOODVOTEX_EXACT_EVALUATION_LIMIT": 60, "GOODVOTEX_EVALUATION_LIMIT": 600})
+    monkeypatch.setattr(cost, "_model", cost.CostModel())
+    assert service.admit_election("approvalBallot", 40, 10, 1000) == "exact"
+    assert service.admit_election("boundedApprovalBallot", 10, 3, 100) == "exact"
+    assert service.admit_election("boundedApprovalBallot", 40, 10, 100) == "approximate"
+    with pytest.raises(Exception):
+        service.admit_election("boundedApprovalBallot", 300, 100, 100000)
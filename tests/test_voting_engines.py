@@ -0,0 +1,277 @@
+from .context import goodvotex
+from goodvotex.voting import engines
+from goodvotex.voting.models import *
+from goodvotex.voting.profile import *
+from .test_voting_models import make_approval_ballot, make_bounded_ballot, make_dummy_election
+
+import itertools
+import math
+import random
+import time
+import pytest
+
+
+
+def make_random_approval_profile(seed, num_candidates, num_ballots):
+    rng = random.Random(seed)
+    e = make_dummy_election(2, "approvalBallot", [str(i) for i in range(num_candidates)])
+    ballots = [make_approval_ballot(rng.sample(range(num_candidates), rng.randint(0, 3))) for _ in range(num_ballots)]
+    return Profile(e.candidates, ballots)
+
+def make_random_bounded_profile(seed, num_candidates, num_ballots):
+    rng = random.Random(seed)
+    e = make_dummy_election(2, "boundedApprovalBallot", [str(i) for i in range(num_candidates)])
+    ballots = list()
+    for _ in range(num_ballots):
+        candidates = list(range(num_candidates))
+        rng.shuffle(candidates)
+        sets = list()
+        for _ in range(rng.randint(1, 3)):
+            size = rng.randint(1, 3)
+            items, candidates = candidates[:size], candidates[size:]
+            if items:
+                lower = rng.randint(0, len(items))
+                upper = rng.randint(lower, len(items))
+                sets.append(BoundedSet(lower, rng.randint(max(lower, 1), max(upper, 1)), upper, {str(c) for c in items}))
+        ballots.append(make_bounded_ballot(*sets))
+    return Profile(e.candidates, ballots)
+
+def committee_ids(profile, result):
+    return sorted(sorted(str(c.id) for c in profile.members(committee)) for committee in result.committees)
+
+def best_committees(profile, committeesize):
+    committees = [sum(members) for members in itertools.combinations(profile.bits.values(), committeesize)]
+    best_score = max(profile.score(committee) for committee in committees)
+    return [committee for committee in committees if profile.score(committee) == best_score]
+
+def assert_finds_winners(profile, committeesize, result, expected):
+    assert result.score == expected.score
+    assert result.ties == len(best_committees(profile, committeesize))
+    assert len(result.committees) == 1 and result.committees[0] in best_committees(profile, committeesize)
+
+
+
+"""
+    Tests for evaluation engines
+"""
+
+def test_choose_engine():
+    candidates = make_dummy_election(2, "any", ['a', 'b', 'c']).candidates
+    mixed = [make_approval_ballot(['a']), make_bounded_ballot(BoundedSet(1,1,1,{'a', 'b'}))]
+    assert engines.choose_engine(Profile(candidates, mixed), "approximate") == engines.approximate
+    assert engines.choose_engine(Profile(candidates, [make_approval_ballot(['a'])])) == engines.approval
+    assert engines.choose_engine(Profile(candidates, [make_approval_ballot(['a'])]), "approximate") == engines.approval
+    assert engines.choose_engine(Profile(candidates, mixed)) == engines.branch_and_bound
+    assert engines.choose_engine(Profile(candidates, mixed), committeesize=2) == engines.branch_and_bound
+    assert engines.choose_engine(Profile(candidates, mixed), engine="vectorized") == engines.vectorized
+    unknown = Profile(candidates, mixed)
+    unknown.entries.append((CompiledBallot(mixed[0], unknown), 1))
+    assert engines.choose_engine(unknown) == engines.exhaustive
+
+def test_approval_engine_matches_exhaustive():
+    for seed in range(20):
+        profile = make_random_approval_profile(seed, 7, 6)
+        for k in [1, 2, 3, 5]:
+            expected = engines.exhaustive(profile, k)
+            result = engines.approval(profile, k)
+            assert result.score == expected.score
+            assert_finds_winners(profile, k, result, expected)
+
+def test_approval_engine_samples_boundary_ties():
+    candidates = make_dummy_election(2, "approvalBallot", ['a', 'b', 'c', 'd']).candidates
+    profile = Profile(candidates, [make_approval_ballot(['a', 'b']), make_approval_ballot(['a', 'c', 'd'])])
+    seen = set()
+    for _ in range(100):
+        result = engines.approval(profile, 2)
+        assert result.score == 3 and result.ties == 3
+        seen.update(tuple(ids) for ids in committee_ids(profile, result))
+    assert seen == {('a', 'b'), ('a', 'c'), ('a', 'd')}
+
+def test_approval_engine_counts_ties_without_votes():
+    candidates = make_dummy_election(12, "approvalBallot", [str(i) for i in range(24)]).candidates
+    result = engines.approval(Profile(candidates, []), 12)
+    assert result.score == 0 and result.ties == 2704156 and len(result.committees) == 1
+
+def test_branch_and_bound_matches_exhaustive():
+    for seed in range(30):
+        profile = make_random_bounded_profile(seed, 8, 5)
+        profile.entries += make_random_approval_profile(seed, 8, 2).entries
+        for k in [1, 3, 4]:
+            expected = engines.exhaustive(profile, k)
+            assert_finds_winners(profile, k, engines.branch_and_bound(profile, k), expected)
+
+def test_branch_and_bound_without_ballots_counts_all_committees():
+    profile = Profile(make_dummy_election(2, "any", ['a', 'b', 'c', 'd']).candidates, [])
+    result = engines.branch_and_bound(profile, 2)
+    assert result.ties == 6 and len(result.committees) == 1
+
+def test_ties_are_broken_uniformly():
+    profile = Profile(make_dummy_election(2, "any", ['a', 'b', 'c', 'd']).candidates, [])
+    for engine in [engines.exhaustive, engines.branch_and_bound, engines.revolving_door, engines.symmetric]:
+        rng = random.Random(0)
+        draws = [engine(profile, 2, rng=rng).committees[0] for _ in range(600)]
+        assert set(draws) == set(best_committees(profile, 2))
+        assert all(50 < draws.count(committee) < 150 for committee in set(draws))
+
+def test_seeded_tie_break_is_reproducible():
+    profile = Profile(make_dummy_election(2, "any", [str(i) for i in range(10)]).candidates, [])
+    for engine in [engines.exhaustive, engines.branch_and_bound, engines.symmetric]:
+        draws = {engine(profile, 4, rng=random.Random(7)).committees[0] for _ in range(5)}
+        assert len(draws) == 1
+
+def test_symmetric_matches_exhaustive():
+    for seed in range(20):
+        profile = make_random_bounded_profile(seed, 9, 2)
+        profile.entries += make_random_approval_profile(seed, 9, 1).entries
+        for k in [1, 3, 4]:
+            expected = engines.exhaustive(profile, k)
+            assert_finds_winners(profile, k, engines.symmetric(profile, k), expected)
+
+def test_symmetry_classes():
+    candidates = make_dummy_election(2, "any", ['a', 'b', 'c', 'd', 'e']).candidates
+    ballots = [make_bounded_ballot(BoundedSet(1, 1, 2, {'a', 'b'}), BoundedSet(0, 1, 1, {'c'}))]
+    profile = Profile(candidates, ballots)
+    classes, rows_of_class = engines._symmetry_classes(profile.rows(), 5)
+    assert sorted(len(members) for members in classes) == [1, 2, 2]
+    assert engines._count_vectors([len(members) for members in classes], 2) == 5
+    result = engines.symmetric(profile, 2)
+    assert result.scored <= 5 and result.ties == len(best_committees(profile, 2))
+
+def test_choose_engine_merges_interchangeable_candidates():
+    candidates = make_dummy_election(2, "any", [str(i) for i in range(25)]).candidates
+    profile = Profile(candidates, [make_bounded_ballot(BoundedSet(1, 1, 2, {'0', '1', '2'}))])
+    assert engines.choose_engine(profile, committeesize=10) == engines.symmetric
+    result = engines.symmetric(profile, 10)
+    assert result.ties == math.comb(3, 1) * math.comb(22, 9) + math.comb(3, 2) * math.comb(22, 8)
+    assert result.scored == 4
+
+def test_approximate_engine_reports_gap():
+    for seed in range(20):
+        profile = make_random_bounded_profile(seed, 8, 6)
+        for k in [2, 4]:
+            expected = engines.exhaustive(profile, k)
+            result = engines.approximate(profile, k)
+            assert not result.exact
+            assert len(result.committees) == 1
+            assert result.committees[0].bit_count() == k
+            assert result.score == profile.score(result.committees[0])
+            assert result.score <= expected.score <= result.upper_bound
+
+def test_unrank_and_advance_follow_itertools():
+    members = engines._unrank(0, 6, 3)
+    for rank, expected in enumerate(itertools.combinations(range(6), 3)):
+        assert engines._unrank(rank, 6, 3) == list(expected)
+        assert members == list(expected)
+        engines._advance(members, 6)
+
+def test_parallel_matches_exhaustive():
+    profile = make_random_bounded_profile(3, 9, 6)
+    for k in [2, 4]:
+        expected = engines.exhaustive(profile, k)
+        assert_finds_winners(profile, k, engines.parallel(profile, k, workers=2), expected)
+
+def test_vectorized_matches_exhaustive():
+    pytest.importorskip("numpy")
+    for seed in range(10):
+        profile = make_random_bounded_profile(seed, 8, 6)
+        profile.entries += make_random_approval_profile(seed, 8, 2).entries
+        for k in [1, 3, 4]:
+            expected = engines.exhaustive(profile, k)
+            assert_finds_winners(profile, k, engines.vectorized(profile, k), expected)
+
+def test_choose_engine_by_name():
+    profile = Profile(make_dummy_election(2, "any", ['a', 'b', 'c']).candidates, [])
+    assert engines.choose_engine(profile, engine="exhaustive") == engines.exhaustive
+    with pytest.raises(Exception):
+        engines.choose_engine(profile, engine="magic")
+
+def test_revolving_door_visits_every_combination_once():
+    for n in range(7):
+        for k in range(n + 1):
+            committee = set(range(k))
+            seen = {frozenset(committee)}
+            for leaving, joining in engines._revolving_door(n, k):
+                assert leaving in committee and joining not in committee
+                committee.remove(leaving)
+                committee.add(joining)
+                seen.add(frozenset(committee))
+            assert len(seen) == len(list(itertools.combinations(range(n), k)))
+
+def test_revolving_door_matches_exhaustive():
+    for seed in range(10):
+        profile = make_random_bounded_profile(seed, 8, 6)
+        profile.entries += make_random_approval_profile(seed, 8, 2).entries
+        for k in [1, 3, 4]:
+            expected = engines.exhaustive(profile, k)
+            assert_finds_winners(profile, k, engines.revolving_door(profile, k), expected)
+
+def test_budget_resumes_where_it_stopped():
+    for seed in range(10):
+        profile = make_random_bounded_profile(seed, 8, 6)
+        expected = engines.exhaustive(profile, 3)
+        for engine in [engines.exhaustive, engines.branch_and_bound]:
+            start, best_score, ties = 0, 0, 0
+            while True:
+                result = engine(profile, 3, budget=engines.Budget(committees=7, start=start, incumbent=best_score))
+                if result.score > best_score:
+                    ties = 0
+                ties += result.ties
+                best_score = result.score
+                if result.complete:
+                    break
+                assert result.position > start and 0 < result.coverage < 1
+                assert result.upper_bound >= expected.score
+                start = result.position
+            assert best_score == expected.score
+            assert ties == expected.ties
+
+def test_time_budget_stops_search():
+    profile = make_random_bounded_profile(1, 14, 10)
+    result = engines.exhaustive(profile, 5, budget=engines.Budget(seconds=1e-9))
+    assert not result.complete
+    assert result.position == engines.Budget.CLOCK_INTERVAL - 1
+
+def test_expired_budget_still_makes_progress(monkeypatch):
+    monkeypatch.setattr(engines.Budget, "CLOCK_INTERVAL", 1)
+    for seed in range(5):
+        profile = make_random_bounded_profile(seed, 8, 6)
+        expected = engines.exhaustive(profile, 3)
+        for engine in [engines.exhaustive, engines.branch_and_bound]:
+            start, best_score, ties = 0, 0, 0
+            for _ in range(expected.total + 1):
+                budget = engines.Budget(seconds=1e-9, start=start, incumbent=best_score)
+                time.sleep(1e-6)
+                result = engine(profile, 3, budget=budget)
+                if result.score > best_score:
+                    ties = 0
+                ties += result.ties
+                best_score = result.score
+                if result.complete:
+                    break
+                assert result.position > start
+                start = result.position
+            assert result.complete
+            assert best_score == expected.score
+            assert ties == expected.ties
+
+def test_engines_report_progress(monkeypatch):
+    monkeypatch.setattr(engines, "PROGRESS_STEPS", 1)
+    profile = make_random_bounded_profile(2, 8, 6)
+    for name in ["exhaustive", "branch-and-bound"]:
+        reported = list()
+        engine = engines.choose_engine(profile, committeesize=3, engine=name, progress=reported.append)
+        result = engine(profile, 3)
+        assert result.scored > 0
+        assert reported and reported == sorted(reported) and 0 <= reported[0] and reported[-1] < 1
+
+def test_rank_inverts_unrank():
+    for rank in range(20):
+        assert engines._rank(engines._unrank(rank, 6, 3), 6) == rank
+
+def test_parallel_reuses_spawned_processes():
+    profile = make_random_bounded_profile(4, 7, 5)
+    engines.parallel(profile, 3, workers=2)
+    pool = engines._get_pool(2)
+    assert pool._mp_context.get_start_method() == "spawn"
+    engines.parallel(profile, 2, workers=2)
+    assert engines._get_pool(2) is pool
@@ -0,0 +1,80 @@
+from .context import goodvotex
+from goodvotex.voting import importers, service
+from goodvotex.auth.models import User
+
+import io
+import json
+import pytest
+
+
+
+def make_election(ballot_type='approvalBallot'):
+    owner = User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+    return service.register_election(ballot_type, 'Foo', 'Bar', ['Alice', 'Bob', 'Carol'], 2, owner)
+
+
+
+"""
+    Tests for importing ballots
+"""
+
+def test_parse_csv():
+    candidates = {'Alice': '1', 'Bob': '2'}
+    lines = list(importers.parse(io.StringIO("Alice,Bob\n\n2, Alice\n"), "csv", "approvalBallot", candidates))
+    assert [(line.line, line.ballot["app_candidates"]) for line in lines] == [(1, ['1', '2']), (3, ['2', '1'])]
+    lines = list(importers.parse(io.StringIO("Alice|Bob:1:1:2,Carol:0:1:1\nAlice:x\n"), "csv",
+                                 "boundedApprovalBallot", candidates))
+    assert lines[0].ballot == {"type": "boundedApprovalBallot", "sets": {"0": ['1', '2'], "1": ['Carol']},
+                               "bounds": {"0": [1, 1, 2], "1": [0, 1, 1]}}
+    assert lines[1].ballot is None and lines[1].error
+
+def test_parse_jsonl():
+    text = '{"app_candidates": ["Alice"], "count": 3}\nnot json\n{"app_candidates": [], "count": 0}\n'
+    lines = list(importers.parse(io.StringIO(text), "jsonl", "approvalBallot", {'Alice': '1'}))
+    assert lines[0] == importers.ImportedLine(1, {"type": "approvalBallot", "app_candidates": ['1']}, 3, None)
+    assert lines[1].error and lines[2].error
+
+def test_parse_preflib():
+    text = "# FILE NAME: test.cat\n# ALTERNATIVE NAME 1: Alice\n# ALTERNATIVE NAME 2: Bob\n" \
+           "12: {1,2},{3}\n3: {}, {1,2}\n2: 2\nfoo\n"
+    lines = list(importers.parse(io.StringIO(text), "preflib", "approvalBallot", {'Alice': '1', 'Bob': '2'}))
+    assert [(line.ballot and line.ballot["app_candidates"], line.count) for line in lines] == \
+        [(['1', '2'], 12), ([], 3), (['2'], 2), (None, 0)]
+    with pytest.raises(Exception):
+        list(importers.parse(io.StringIO(text), "preflib", "boundedApprovalBallot", {}))
+    assert importers.guess_format("votes.cat") == "preflib"
+    with pytest.raises(Exception):
+        importers.guess_format("votes.xlsx")
+
+def test_add_votes_from_json(app):
+    with app.app_context():
+        e = make_election()
+        ids = [str(c.id) for c in e.candidates]
+        errors = service.add_votes_from_json(e.id, [
+            {'type': 'approvalBallot', 'app_candidates': ids[:2]},
+            {'type': 'approvalBallot', 'app_candidates': ['x']},
+            {'type': 'boundedApprovalBallot', 'sets': {}, 'bounds': {}},
+            {'type': 'approvalBallot', 'app_candidates': ids[:2]},
+        ], [1, 1, 1, 4])
+        assert errors[0] is None and errors[1] and errors[2] and errors[3] is None
+        assert e.votecount == 5 == len(e.ballots) == sum(p.count for p in e.patterns)
+
+def test_import_ballots_command(app, tmp_path):
+    with app.app_context():
+        e = make_election()
+        election_id, bob = e.id, str(e.candidates[1].id)
+    path = tmp_path / "votes.jsonl"
+    path.write_text("\n".join(json.dumps(ballot) for ballot in [
+        {"app_candidates": ["Alice", "Carol"]},
+        {"app_candidates": [bob], "count": 2},
+        {"app_candidates": ["Dave"]},
+    ]))
+    result = app.test_cli_runner().invoke(args=["goodvotex", "import-ballots", str(election_id), str(path),
+                                                "--chunk-size", "2"])
+    assert "Rejected line 3" in result.output
+    assert "Imported 3 ballots" in result.output and "rejected 1 lines" in result.output
+    with app.app_context():
+        e = service.get_election(election_id)
+        assert e.votecount == 3 == len(e.ballots)
+    result = app.test_cli_runner().invoke(args=["goodvotex", "import-ballots", "999", str(path)])
+    assert "doesn't exist" in result.output
@@ -0,0 +1,155 @@
+from .context import goodvotex
+from goodvotex.voting import cost, service, voting
+from goodvotex.voting.models import *
+from goodvotex.auth.models import User
+
+import datetime
+import json
+
+import pytest
+
+
+
+def make_owner_and_election(candidates=('a', 'b', 'c')):
+    owner = User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+    e = service.register_election('approvalBallot', 'Foo', 'Bar', list(candidates), 2, owner)
+    return owner, e
+
+
+
+"""
+    Tests for background evaluation
+"""
+
+def test_evaluation_jobs_are_shared(app):
+    with app.app_context():
+        owner, e = make_owner_and_election()
+        job = service.request_evaluation(e.id, owner)
+        assert service.request_evaluation(e.id, owner).id == job.id
+        ids = [str(c.id) for c in e.candidates]
+        service.add_vote_from_json(e.id, {'type': 'approvalBallot', 'app_candidates': ids[:2]})
+        assert service.request_evaluation(e.id, owner).id != job.id
+        assert service.get_latest_evaluation_job(e.id).votecount == 1
+
+def test_worker_runs_jobs(app):
+    with app.app_context():
+        owner, e = make_owner_and_election()
+        ids = [str(c.id) for c in e.candidates]
+        service.add_vote_from_json(e.id, {'type': 'approvalBallot', 'app_candidates': ids[1:]})
+        job = service.request_evaluation(e.id, owner)
+        assert not job.is_finished()
+        election_id, job_id = e.id, job.id
+
+    result = app.test_cli_runner().invoke(args=['goodvotex', 'worker', '--once'])
+    assert "done" in result.output
+
+    with app.app_context():
+        assert service.claim_evaluation_job() is None
+        assert goodvotex.db.session.get(EvaluationJob, job_id).status == "done"
+        winners = service.get_election(election_id).get_winners()
+        assert sorted(c.name for c in winners) == ['b', 'c']
+
+def test_create_db_upgrades_old_database(app):
+    with app.app_context():
+        goodvotex.db.drop_all()
+        with goodvotex.db.engine.begin() as connection:
+            connection.execute(goodvotex.db.text(
+                "CREATE TABLE election (id INTEGER PRIMARY KEY, title VARCHAR(60) NOT NULL, "
+                "description VARCHAR(500) NOT NULL, committeesize INTEGER, is_stopped BOOLEAN, "
+                "votecount INTEGER, owner_id INTEGER NOT NULL, ballot_type VARCHAR(60) NOT NULL)"))
+            connection.execute(goodvotex.db.text(
+                "INSERT INTO election VALUES (1, 'Foo', 'Bar', 2, 0, 0, 1, 'approvalBallot')"))
+
+    result = app.test_cli_runner().invoke(args=['goodvotex', 'create-db'])
+    assert "Added column election.evaluation_mode." in result.output
+
+    with app.app_context():
+        e = service.get_election(1)
+        assert e.evaluation_mode == "exact"
+        assert not e.has_current_result()
+
+def test_tallies_do_not_lose_concurrent_votes(app):
+    with app.app_context():
+        owner, e = make_owner_and_election()
+        ids = [str(c.id) for c in e.candidates]
+        vote = {'type': 'approvalBallot', 'app_candidates': ids[:2]}
+        service.add_vote_from_json(e.id, vote)
+        e = service.get_election(e.id)
+        assert [p.count for p in e.patterns] == [1]
+        # Another request counts the same vote after this one has read the tallies.
+        goodvotex.db.session.execute(goodvotex.db.text("UPDATE ballot_pattern SET count = count + 1"))
+        service.add_vote_from_json(e.id, vote)
+        assert [p.count for p in service.get_election(e.id).patterns] == [3]
+
+def test_concurrent_requests_share_the_job(app, monkeypatch):
+    with app.app_context():
+        owner, e = make_owner_and_election()
+        job = service.request_evaluation(e.id, owner)
+        # The second request looks for the job before the first one created it.
+        find = service._find_evaluation_job
+        calls = []
+
+        def find_late(*args):
+            calls.append(args)
+            return find(*args) if len(calls) > 1 else None
+
+        monkeypatch.setattr(service, "_find_evaluation_job", find_late)
+        assert service.request_evaluation(e.id, owner).id == job.id
+        assert EvaluationJob.query.count() == 1
+
+def test_stale_running_jobs_are_claimed_again(app):
+    with app.app_context():
+        owner, e = make_owner_and_election()
+        job = service.request_evaluation(e.id, owner)
+        assert service.claim_evaluation_job().id == job.id
+        assert service.claim_evaluation_job() is None
+        job.started_at = datetime.datetime.now() - datetime.timedelta(hours=2)
+        goodvotex.db.session.commit()
+        assert service.claim_evaluation_job().id == job.id
+
+def test_too_expensive_elections_are_evaluated_approximately_for_now(app, monkeypatch):
+    monkeypatch.setitem(voting.config, "GOODVOTEX_EXACT_EVALUATION_LIMIT", 60)
+    with app.app_context():
+        owner = User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+        e = service.register_election('boundedApprovalBallot', 'Foo', 'Bar', ['a', 'b', 'c', 'd'], 2, owner)
+        monkeypatch.setattr(cost.get_model(), "fastest_exact", lambda *args: ("branch-and-bound", 3600))
+        service.evaluate(e.id, owner)
+        assert e.evaluation_mode == "exact"
+        assert e.result_mode == "approximate" and e.has_current_result()
+
+def test_worker_reports_progress_and_stats(app, monkeypatch):
+    monkeypatch.setattr(service, "PROGRESS_INTERVAL", 0)
+    monkeypatch.setattr(goodvotex.voting.engines, "PROGRESS_STEPS", 1)
+    with app.app_context():
+        owner = User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+        e = service.register_election('boundedApprovalBallot', 'Foo', 'Bar', list('abcdefg'), 3, owner)
+        ids = [str(c.id) for c in e.candidates]
+        for i in range(5):
+            service.add_vote_from_json(e.id, {'type': 'boundedApprovalBallot',
+                                              'sets': {'0': ids[i:i + 3]}, 'bounds': {'0': [1, 2, 2]}})
+        job_id = service.request_evaluation(e.id, owner).id
+        reported = list()
+        commit = goodvotex.db.session.commit
+
+        def commit_and_record():
+            reported.append(goodvotex.db.session.get(EvaluationJob, job_id).progress)
+            commit()
+
+        monkeypatch.setattr(goodvotex.db.session, "commit", commit_and_record)
+        service.run_evaluation_job(service.claim_evaluation_job())
+        job = service.get_evaluation_progress(e.id, owner)
+        assert job.status == "done" and job.progress == 1
+        assert 0 < max(reported[:-1]) < 1
+        stats = json.loads(job.stats)
+        assert set(stats["timings"]) == {"load", "decode", "search", "tie-break"}
+        assert stats["counters"]["ballots"] == 5 and stats["counters"]["distinct_ballots"] == 5
+        assert stats["counters"]["committees_scored"] > 0
+
+def test_evaluations_are_profiled_into_directory(app, monkeypatch, tmp_path):
+    profile_dir = tmp_path / "profiles"
+    profile_dir.mkdir()
+    monkeypatch.setitem(voting.config, "GOODVOTEX_PROFILE_DIR", str(profile_dir))
+    with app.app_context():
+        owner, e = make_owner_and_election()
+        service.evaluate(e.id, owner)
+        assert [path.suffix for path in profile_dir.iterdir()] == [".prof"]
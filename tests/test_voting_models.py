@@ -94,6 +94,97 @@ def test_winners():
     winners = e.get_winners()
     assert len(winners) == 3
     assert {str(c.id) for c in winners} == {'b', 'c', 'e'}
+    assert e.winner_score == 10
+
+def test_approximate_winners():
+    e = make_dummy_election(2, "boundedApprovalBallot", ['a', 'b', 'c', 'd'])
+    e.evaluation_mode = "approximate"
+    e.add_ballot(make_bounded_ballot(BoundedSet(0, 2, 2, {'a', 'b'})))
+    e.add_ballot(make_bounded_ballot(BoundedSet(0, 1, 2, {'b', 'c'})))
+    e.recompute_current_winner()
+    assert {str(c.id) for c in e.get_winners()} == {'a', 'b'}
+    assert e.winner_score == 3
+    assert e.winner_score_bound >= 3
+
+def test_approval_winners_are_exact_in_approximate_mode():
+    e = make_dummy_election(2, "approvalBallot", ['a', 'b', 'c', 'd'])
+    e.evaluation_mode = "approximate"
+    e.add_ballot(make_approval_ballot(['a', 'b']))
+    e.add_ballot(make_approval_ballot(['b', 'c']))
+    e.add_ballot(make_approval_ballot(['c']))
+    e.recompute_current_winner()
+    assert {str(c.id) for c in e.get_winners()} == {'b', 'c'}
+    assert e.winner_score == e.winner_score_bound == 4
+
+
+def test_provisional_winners_are_resumed():
+    def make_election():
+        e = make_dummy_election(2, "boundedApprovalBallot", ['a', 'b', 'c', 'd', 'e'])
+        e.add_ballot(make_bounded_ballot(BoundedSet(1, 1, 2, {'a', 'b'}), BoundedSet(0, 1, 1, {'c'})))
+        e.add_ballot(make_bounded_ballot(BoundedSet(2, 1, 2, {'d', 'e'})))
+        e.add_ballot(make_bounded_ballot(BoundedSet(1, 1, 1, {'e', 'a'})))
+        return e
+    expected = make_election()
+    expected.recompute_current_winner()
+    e = make_election()
+    e.recompute_current_winner(committee_budget=3)
+    assert e.result_provisional and e.can_resume() and not e.has_current_result()
+    assert 0 < e.result_coverage < 1
+    while e.result_provisional:
+        position = e.result_position
+        e.recompute_current_winner(committee_budget=3)
+        assert not e.result_provisional or e.result_position > position
+    assert e.has_current_result() and e.result_coverage == 1
+    assert e.winner_score == expected.winner_score
+    assert e.winner_ties == expected.winner_ties
+    assert e._score(e.get_winners()) == expected.winner_score
+
+def test_seeded_tie_break_is_reproducible():
+    winners = set()
+    for _ in range(5):
+        e = make_dummy_election(3, "boundedApprovalBallot", [str(i) for i in range(25)])
+        e.tiebreak_seed = 42
+        e.recompute_current_winner()
+        assert e.winner_ties == 2300 and e.winner_score == 0
+        winners.add(frozenset(c.id for c in e.get_winners()))
+    assert len(winners) == 1
+
+def test_evaluation_stats():
+    e = make_dummy_election(2, "approvalBallot", ['a', 'b', 'c'])
+    e.add_ballot(make_approval_ballot(['a', 'b']))
+    e.add_ballot(make_approval_ballot(['a', 'b']))
+    e.add_ballot(make_approval_ballot(['c']))
+    stats = EvaluationStats()
+    e.recompute_current_winner(stats=stats)
+    assert list(stats.timings) == EvaluationStats.PHASES
+    assert stats.counters == {"ballots": 3, "distinct_ballots": 2, "committees_scored": 1, "ties": 1}
+    assert "committees_scored=1" in str(stats)
+
+def test_running_tallies():
+    e = make_dummy_election(2, "approvalBallot", ['a', 'b', 'c'])
+    e.add_ballot(make_approval_ballot(['a', 'b']))
+    e.add_ballot(make_approval_ballot(['b', 'a']))
+    e.add_ballot(make_approval_ballot(['c']))
+    assert sorted(p.count for p in e.patterns) == [1, 2]
+    assert e.recount()
+
+    e.ballots = e.ballots[:1]  # tallies are not changed
+    e.recompute_current_winner()
+    assert e.winner_score == 4
+    assert not e.recount()
+    assert [p.count for p in e.patterns] == [1]
+
+def test_ballots_with_same_content_have_same_encoding():
+    assert make_approval_ballot(['a', 'b', 'a']).json_encoded == make_approval_ballot(['b', 'a']).json_encoded
+    b1 = make_bounded_ballot(BoundedSet(1,2,3,{'a', 'b', 'c'}), BoundedSet(1,1,1,{'d', 'e'}))
+    b2 = make_bounded_ballot(BoundedSet(1,1,1,{'e', 'd'}), BoundedSet(1,2,3,{'c', 'a', 'b'}))
+    assert b1.json_encoded == b2.json_encoded
+
+def test_ballot_pattern_to_ballot():
+    b = make_bounded_ballot(BoundedSet(1,2,3,{'a', 'b', 'c'}), BoundedSet(1,1,1,{'d', 'e'}))
+    copy = BallotPattern(ballot_type=b.type, json_encoded=b.json_encoded, count=1).to_ballot()
+    assert type(copy) == BoundedApprovalBallot
+    assert copy.score({'a', 'b', 'd'}) == b.score({'a', 'b', 'd'})
 
 
 
@@ -163,6 +254,12 @@ def test_bounded_set_phi():
     assert bs.phi({"a", "c", "e", "f", "g"}) == 3 / 5
     assert bs.phi({"a", "c", "e", "f", "g", "b"}) == 0
 
+def test_bounded_set_contribution():
+    bs = BoundedSet(2, 3, 5, {"a", "b", "c", "d", "e", "f", "g"})
+    for committee in [{"a"}, {"a", "c"}, {"a", "c", "e"}, {"a", "c", "e", "f"}, {"a", "c", "e", "f", "g", "b"}]:
+        assert bs.contribution(bs.intersection_size(committee)) == bs.phi(committee) * bs.intersection_size(committee)
+    assert bs.contribution(5) == 3
+
 def test_bounded_ballots_validity():
     e = make_dummy_election(3, 'boundedApprovalBallot', ['a', 'b', 'c', 'd', 'f', 'g'])
     bs1 = BoundedSet(2, 3, 3, {"a", "b", "c", "d"})
@@ -0,0 +1,56 @@
+from .context import goodvotex
+from goodvotex.voting.models import *
+from goodvotex.voting.profile import *
+from .test_voting_models import make_approval_ballot, make_bounded_ballot
+
+import pytest
+from unittest.mock import patch
+
+
+
+"""
+    Tests for compiled ballot profiles
+"""
+
+def make_profile(candidate_ids, ballots):
+    return Profile([Candidate(name=cid, id=cid) for cid in candidate_ids], ballots)
+
+def test_compiled_ballots_score_like_ballots():
+    approval = make_approval_ballot(['a', 'b', 'c'])
+    bounded = make_bounded_ballot(BoundedSet(1,2,3,{'a', 'b', 'c', 'd'}), BoundedSet(2,3,3,{'g', 'h', 'i'}))
+    profile = make_profile(['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i'], [])
+    for committee in [{'a'}, {'a', 'b', 'g'}, {'a', 'b', 'c', 'd', 'g', 'h'}, {'e', 'f'}]:
+        assert approval.compile(profile).score(profile.mask(committee)) == approval.score(committee)
+        assert bounded.compile(profile).score(profile.mask(committee)) == bounded.score(committee)
+        assert CompiledBallot(bounded, profile).score(profile.mask(committee)) == bounded.score(committee)
+
+def test_contribution_table():
+    assert contribution_table(0b1111, 1, 2, 3) == (0, 1, 2, 2, 0)
+    assert contribution_table(0b11, 0, 2, 2, weight=3) == (0, 3, 6)
+    for size in range(6):
+        assert contribution_table(0b11111, 2, 3, 4)[size] == BoundedSet(2, 3, 4, set('abcde')).contribution(size)
+
+def test_profile_bitmasks():
+    profile = make_profile(['a', 'b', 'c', 'd'], [])
+    assert profile.mask(['a', 'c']) == 0b101
+    assert profile.mask(['d', 'x']) == 0b1000
+    assert [c.id for c in profile.members(0b1010)] == ['b', 'd']
+
+def test_profile_decodes_each_ballot_once():
+    ballots = [make_approval_ballot(['a', 'b']), make_approval_ballot(['b', 'c'])]
+    with patch('goodvotex.voting.models.json.loads', wraps=json.loads) as loads:
+        profile = make_profile(['a', 'b', 'c', 'd'], ballots)
+        assert loads.call_count == 2
+        assert profile.score(profile.mask({'a', 'b'})) == 3
+        assert profile.score(profile.mask({'b', 'c'})) == 3
+        assert profile.score(profile.mask({'d'})) == 0
+        assert loads.call_count == 2
+
+def test_profile_merges_identical_ballots():
+    ballots = [make_approval_ballot(['a', 'b']), make_approval_ballot(['b', 'a']), make_approval_ballot(['c']),
+               make_bounded_ballot(BoundedSet(1,1,2,{'a', 'b'}), BoundedSet(1,1,1,{'c'})),
+               make_bounded_ballot(BoundedSet(1,1,1,{'c'}), BoundedSet(1,1,2,{'b', 'a'}))]
+    profile = make_profile(['a', 'b', 'c'], ballots)
+    assert profile.ballot_count == 5
+    assert sorted(count for entry, count in profile.entries) == [1, 2, 2]
+    assert profile.score(profile.mask({'a', 'c'})) == sum(b.score({'a', 'c'}) for b in ballots)
@@ -1,6 +1,7 @@
 from .context import goodvotex
 from goodvotex.voting import service
 from goodvotex.voting.models import *
+from goodvotex.auth.models import User
 
 import pytest
 from unittest.mock import Mock, patch
@@ -25,6 +26,10 @@ def test_register_election():
     assert service.db.session.add.called
     assert service.db.session.commit.called
 
+def test_register_election_with_unknown_mode():
+    with pytest.raises(Exception):
+        service.register_election('any', 'Foo', 'Bar', ['a', 'b', 'c'], 2, Mock_User(), 'magic')
+
 @patch('goodvotex.voting.service.get_all_elections')
 def test_service_search(mock_get_elections):
     mock_get_elections.return_value = [
@@ -40,15 +45,55 @@ def test_service_search(mock_get_elections):
     with pytest.raises(Exception): # Search string too long
         service.search("A"*70)
 
-@patch('goodvotex.voting.service.get_election')
-def test_service_add_vote(mock_get_election):
-    e = Election(id=42, candidates=[Candidate(id='a'), Candidate(id='b'), Candidate(id='c')], ballot_type='any', ballots=list(), votecount=0)
-    mock_get_election.return_value = e
-    service.add_vote_from_json(42, {'type' : 'approvalBallot', 'app_candidates' : ['a', 'b']})
-    assert e.ballots[0].get_involved_candidates() == {'a', 'b'}
+def make_owner():
+    return User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+
+def test_service_add_vote(app):
+    with app.app_context():
+        e = service.register_election('any', 'Foo', 'Bar', ['a', 'b', 'c'], 2, make_owner())
+        ids = {c.name: str(c.id) for c in e.candidates}
+        service.add_vote_from_json(e.id, {'type' : 'approvalBallot', 'app_candidates' : [ids['a'], ids['b']]})
+        assert e.ballots[0].get_involved_candidates() == {ids['a'], ids['b']}
+        assert e.votecount == 1
 
-    with pytest.raises(Exception): # Candidate not in election
-        service.add_vote_from_json(42, {'type' : 'approvalBallot', 'app_candidates' : ['a','e']})
+        with pytest.raises(Exception): # Candidate not in election
+            service.add_vote_from_json(e.id, {'type' : 'approvalBallot', 'app_candidates' : [ids['a'], 'e']})
+        with pytest.raises(Exception): # Election does not exist
+            service.add_vote_from_json(e.id + 1, {'type' : 'approvalBallot', 'app_candidates' : [ids['a']]})
+        assert e.votecount == 1 and len(e.ballots) == 1
+
+def test_service_add_vote_to_stopped_election(app):
+    with app.app_context():
+        e = service.register_election('approvalBallot', 'Foo', 'Bar', ['a', 'b', 'c'], 2, make_owner())
+        vote = {'type' : 'approvalBallot', 'app_candidates' : [str(e.candidates[0].id)]}
+        e.stop()
+        goodvotex.db.session.commit()
+        with pytest.raises(Exception):
+            service.add_vote_from_json(str(e.id), vote)
+        e.restart()
+        goodvotex.db.session.commit()
+        service.add_vote_from_json(str(e.id), vote)
+        assert e.votecount == 1 and sum(p.count for p in e.patterns) == 1
+
+def test_service_add_vote_does_not_load_ballots(app):
+    from sqlalchemy import event
+    with app.app_context():
+        e = service.register_election('approvalBallot', 'Foo', 'Bar', ['a', 'b', 'c'], 2, make_owner())
+        election_id, vote = e.id, {'type' : 'approvalBallot', 'app_candidates' : [str(e.candidates[0].id)]}
+        statements = list()
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(goodvotex.db.engine, "before_cursor_execute", listener)
+        try:
+            queries = list()
+            for _ in range(20):
+                del statements[:]
+                service.add_vote_from_json(election_id, vote)
+                queries.append(len(statements))
+        finally:
+            event.remove(goodvotex.db.engine, "before_cursor_execute", listener)
+        assert len(set(queries[1:])) == 1
+        assert not any("FROM ballot" in statement for statement in statements)
+        assert service.get_election(election_id).votecount == 20
 
 @patch('goodvotex.voting.service.get_election')
 def test_service_stop_election(mock_get_election):
@@ -70,4 +115,74 @@ def test_service_evaluate_election(mock_get_election):
     service.evaluate(42, u)
     assert service.db.session.add.called
     assert service.db.session.commit.called
-    assert {str(c.id) for c in e.get_winners()} == {'a', 'c'}
\ No newline at end of file
+    assert {str(c.id) for c in e.get_winners()} == {'a', 'c'}
+
+def test_service_evaluate_uses_cached_result(app):
+    with app.app_context():
+        u = Mock_User()
+        e = service.register_election('any', 'Foo', 'Bar', ['a', 'b', 'c'], 2, make_owner())
+        u.elections.append(e)
+        ids = {c.name: str(c.id) for c in e.candidates}
+        service.add_vote_from_json(e.id, {'type' : 'approvalBallot', 'app_candidates' : [ids['a'], ids['b']]})
+        service.evaluate(e.id, u)
+        with patch.object(Election, 'recompute_current_winner') as recompute:
+            service.evaluate(e.id, u)
+            e.result_votecount = None  # only the in-process tier is left
+            service.evaluate(e.id, u)
+            assert not recompute.called
+        assert {c.name for c in e.get_winners()} == {'a', 'b'}
+
+        service.add_vote_from_json(e.id, {'type' : 'approvalBallot', 'app_candidates' : [ids['c']]})
+        with patch.object(Election, 'recompute_current_winner') as recompute:
+            service.evaluate(e.id, u)
+            assert recompute.called
+
+def test_result_cache_evicts_least_recently_used():
+    cache = service.ResultCache(maxsize=2)
+    cache.put((1, 0, 'exact'), 'r1')
+    cache.put((2, 0, 'exact'), 'r2')
+    assert cache.get((1, 0, 'exact')) == 'r1'
+    cache.put((3, 0, 'exact'), 'r3')
+    assert cache.get((2, 0, 'exact')) is None
+    assert cache.get((1, 0, 'exact')) == 'r1'
+    cache.invalidate(1)
+    assert cache.get((1, 0, 'exact')) is None
+    assert cache.hits == 2 and cache.misses == 2
+
+def test_parallel_votes_are_all_counted(app):
+    from concurrent.futures import ThreadPoolExecutor
+    with app.app_context():
+        e = service.register_election('approvalBallot', 'Foo', 'Bar', ['a', 'b', 'c', 'd'], 2, make_owner())
+        election_id, ids = e.id, [str(c.id) for c in e.candidates]
+    votes = [{'type' : 'approvalBallot', 'app_candidates' : ids[i % 4:i % 4 + 2]} for i in range(2000)]
+
+    def vote(chunk):
+        client = app.test_client()
+        return [client.post("/vote/%d" % election_id, json=v).status_code for v in chunk]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        statuses = [status for chunk in pool.map(vote, [votes[i::16] for i in range(16)]) for status in chunk]
+    assert statuses == [200] * len(votes)
+    with app.app_context():
+        e = service.get_election(election_id)
+        assert e.votecount == len(votes) == len(e.ballots) == sum(p.count for p in e.patterns)
+
+def test_writes_are_retried_while_database_is_locked(app, monkeypatch):
+    import sqlite3
+    from sqlalchemy.exc import OperationalError
+    monkeypatch.setattr(service, "WRITE_BACKOFF", 0)
+    calls = list()
+
+    def write():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OperationalError("UPDATE", {}, sqlite3.OperationalError("database is locked"))
+        return "done"
+
+    def broken():
+        calls.append(1)
+        raise OperationalError("UPDATE", {}, sqlite3.OperationalError("no such table: election"))
+    with app.app_context():
+        assert service._retry_if_busy(write) == "done" and len(calls) == 3
+        with pytest.raises(OperationalError):
+            service._retry_if_busy(broken)
+        assert len(calls) == 4
@@ -0,0 +1,51 @@
+from .context import goodvotex
+from goodvotex.voting import service, voting
+from goodvotex.auth.models import User
+
+
+
+def make_election():
+    owner = User(username="owner", name="Owner", email="owner@example.com", password_hash="x")
+    return service.register_election('approvalBallot', 'Foo', 'Bar', ['Alice', 'Bob', 'Carol'], 2, owner)
+
+
+
+"""
+    Tests for the voting views
+"""
+
+def test_batch_vote(app):
+    with app.app_context():
+        e = make_election()
+        election_id, ids = e.id, [str(c.id) for c in e.candidates]
+    client = app.test_client()
+    response = client.post("/vote/%d/batch" % election_id, json=[
+        {'type': 'approvalBallot', 'app_candidates': ids[:2]},
+        {'type': 'approvalBallot', 'app_candidates': ['999']},
+        {'type': 'approvalBallot', 'app_candidates': ids[1:]},
+        {'app_candidates': ids[1:]},
+    ])
+    assert response.status_code == 200
+    assert response.json["accepted"] == 2 and response.json["rejected"] == 2
+    assert [result["accepted"] for result in response.json["results"]] == [True, False, True, False]
+    assert response.json["results"][1]["error"]
+    with app.app_context():
+        e = service.get_election(election_id)
+        assert e.votecount == 2 == len(e.ballots)
+
+def test_batch_vote_rejects_bad_requests(app, monkeypatch):
+    with app.app_context():
+        e = make_election()
+        election_id, ids = e.id, [str(c.id) for c in e.candidates]
+    client = app.test_client()
+    assert client.post("/vote/%d/batch" % election_id, json={'type': 'approvalBallot'}).status_code == 400
+    assert client.post("/vote/999/batch", json=[]).status_code == 400
+    monkeypatch.setitem(voting.config, "GOODVOTEX_MAX_BATCH_VOTES", 1)
+    ballot = {'type': 'approvalBallot', 'app_candidates': ids[:1]}
+    assert client.post("/vote/%d/batch" % election_id, json=[ballot, ballot]).status_code == 413
+    with app.app_context():
+        service.get_election(election_id).is_stopped = True
+        goodvotex.db.session.commit()
+    assert client.post("/vote/%d/batch" % election_id, json=[ballot]).status_code == 400
+    with app.app_context():
+        assert service.get_election(election_id).votecount == 0